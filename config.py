@@ -1,23 +1,51 @@
 from __future__ import annotations
 
-from dataclasses import dataclass
+from dataclasses import dataclass, field
+from functools import lru_cache
 from pathlib import Path
-from typing import List, Dict, Optional
+from types import MappingProxyType
+from typing import Any, Callable, List, Dict, Mapping, Optional, Tuple
 import os
+import re
+import sys
 
 from dotenv import load_dotenv
 
 # -------------------------
 # Load .env (SAFE)
 # -------------------------
-# В проде .env может отсутствовать — это нормально
-load_dotenv(override=False)
+# В проде .env может отсутствовать — это нормально.
+# Если .env скомпилирован (tools/compile_env.py), импортируем готовый модуль
+# и не парсим текстовый файл на каждом старте. Если .env новее модуля
+# (правили и не перекомпилировали) — читаем сам .env, иначе правки потерялись бы.
+_ENV_PATH = Path(__file__).resolve().parent / ".env"
+_ENV_COMPILED_PATH = _ENV_PATH.with_name("env_compiled.py")
+
+
+def _env_compiled_is_fresh() -> bool:
+    try:
+        compiled_mtime = _ENV_COMPILED_PATH.stat().st_mtime
+    except OSError:
+        return False
+    try:
+        return _ENV_PATH.stat().st_mtime <= compiled_mtime
+    except OSError:
+        return True
+
+
+if _env_compiled_is_fresh():
+    try:
+        import env_compiled  # noqa: F401
+    except ImportError:
+        load_dotenv(override=False)
+else:
+    load_dotenv(override=False)
 
 
 # -------------------------
 # Companies / Tokens
 # -------------------------
-COMPANIES: List[str] = [
+COMPANIES: Tuple[str, ...] = tuple(map(sys.intern, (
     "ООО Кустос",
     "ООО Поле",
     "ООО ТЭК",
@@ -35,9 +63,9 @@ COMPANIES: List[str] = [
     "ИП Малецкий",
     "ОТЭ",
     "Клуб СБ Фрегат",
-]
+)))
 
-COMPANY_TOKEN_MAP: Dict[str, str] = {
+_COMPANY_TOKENS: Dict[str, str] = {
     "ООО Кустос": "KEY-01",
     "ООО Поле": "KEY-02",
     "ООО ТЭК": "KEY-03",
@@ -57,26 +85,44 @@ COMPANY_TOKEN_MAP: Dict[str, str] = {
     "Клуб СБ Фрегат": "KEY-17",
 }
 
+# Названия компаний и token_id ходят по всему боту (карточки, журнал, FSM) —
+# интернируем, чтобы сравнения и хранение шли по одному объекту строки.
+COMPANY_TOKEN_MAP: Mapping[str, str] = MappingProxyType(
+    {sys.intern(company): sys.intern(token_id) for company, token_id in _COMPANY_TOKENS.items()}
+)
+
+# Обратный индекс token_id -> компания (O(1) вместо перебора)
+TOKEN_COMPANY_MAP: Mapping[str, str] = MappingProxyType({v: k for k, v in COMPANY_TOKEN_MAP.items()})
+
 
 # -------------------------
 # Status constants
 # -------------------------
-STATUS_REQUESTED = "REQUESTED"
-STATUS_APPROVED = "APPROVED"
-STATUS_REJECTED = "REJECTED"
-STATUS_ISSUED = "ISSUED"
-STATUS_RETURNED = "RETURNED"
+# Интернированы: статусы сравниваются в переходах состояний и массово
+# встречаются в строках заявок из БД.
+STATUS_REQUESTED = sys.intern("REQUESTED")
+STATUS_APPROVED = sys.intern("APPROVED")
+STATUS_REJECTED = sys.intern("REJECTED")
+STATUS_ISSUED = sys.intern("ISSUED")
+STATUS_RETURNED = sys.intern("RETURNED")
 
-TOKEN_AVAILABLE = "available"
-TOKEN_ISSUED = "issued"
-TOKEN_RESERVED = "reserved"
+TOKEN_AVAILABLE = sys.intern("available")
+TOKEN_ISSUED = sys.intern("issued")
+TOKEN_RESERVED = sys.intern("reserved")
 
 
 # -------------------------
 # Settings dataclass
 # -------------------------
-@dataclass(frozen=True)
+@dataclass(slots=True)
 class Settings:
+    """
+    Настройки процесса. Экземпляр один на процесс (load_settings кэшируется)
+    и считается неизменяемым: поля после загрузки не присваивать.
+    frozen=True не используем — он замедляет конструирование, а со slots
+    экземпляр ещё и без __dict__.
+    """
+
     bot_token: str
     director_tg_id: int
     officer_tg_id: int
@@ -90,93 +136,134 @@ class Settings:
     remind_repeat_minutes: int
     remind_check_seconds: int
 
-    # Nextcloud WebDAV
+    # Nextcloud WebDAV (необязательно: пустые значения — журнал отключён)
     nc_webdav_url: str
     nc_user: str
     nc_app_password: str
     journal_path: str
 
-    # Database
-    db_path: Path
+    # Database (путь резолвится лениво, см. db_path)
+    db_path_raw: str
 
     # Limits
     max_companies_per_request: int
     max_purpose_length: int
     max_comment_length: int
 
+    # Вычисляются в load_settings: заданы все четыре NC_*/JOURNAL_* параметра;
+    # напоминания директору включены (есть адресат и все интервалы > 0)
+    journal_enabled: bool = False
+    reminders_enabled: bool = False
+
+    _db_path: Optional[Path] = field(default=None, init=False, repr=False, compare=False)
+
+    @property
+    def db_path(self) -> Path:
+        # resolve() ходит в ФС — делаем это при первом обращении, а не при загрузке настроек
+        if self._db_path is None:
+            self._db_path = Path(self.db_path_raw).expanduser().resolve()
+        return self._db_path
+
 
 # -------------------------
-# ENV helpers
+# ENV parsers
 # -------------------------
-def _get_env_str(name: str) -> str:
-    val = os.getenv(name)
-    if not val or not str(val).strip():
+# Единая сигнатура: (env, name, default, bounds) -> value
+def _parse_str(env: Mapping[str, str], name: str, default: Any, bounds: Optional[Tuple[int, int]]) -> str:
+    val = env.get(name)
+    if not val or not val.strip():
         raise RuntimeError(f"Missing required environment variable: {name}")
-    return str(val).strip()
+    return val.strip()
 
 
-def _get_env_int(name: str) -> int:
-    raw = _get_env_str(name)
+def _parse_opt_str(env: Mapping[str, str], name: str, default: Any, bounds: Optional[Tuple[int, int]]) -> Any:
+    val = env.get(name)
+    return val.strip() if val and val.strip() else default
+
+
+def _parse_int(env: Mapping[str, str], name: str, default: Any, bounds: Optional[Tuple[int, int]]) -> int:
+    raw = _parse_str(env, name, None, None)
     try:
         return int(raw)
     except ValueError:
         raise RuntimeError(f"Environment variable {name} must be int, got: {raw!r}")
 
 
-def _get_env_int_list(name: str) -> List[int]:
-    raw = os.getenv(name, "").strip()
-    if not raw:
-        return []
-    out: List[int] = []
-    for part in raw.replace(";", ",").split(","):
-        part = part.strip()
-        if part.isdigit():
-            out.append(int(part))
-    return out
-
-
-def _get_int_default(name: str, default: int, *, min_v: int = 0, max_v: int = 10_000) -> int:
-    raw = os.getenv(name)
+def _parse_int_range(env: Mapping[str, str], name: str, default: Any, bounds: Optional[Tuple[int, int]]) -> int:
+    raw = env.get(name)
     if not raw or not raw.strip():
         return default
+    min_v, max_v = bounds or (0, 10_000)
     try:
-        val = int(raw.strip())
-        return max(min_v, min(val, max_v))
+        return max(min_v, min(int(raw.strip()), max_v))
     except ValueError:
         return default
 
 
-# -------------------------
-# Loader
-# -------------------------
-def load_settings() -> Settings:
-    db_path = Path(os.getenv("DB_PATH", "bot.db")).expanduser().resolve()
+_INT_TOKEN_RE = re.compile(r"\d+")
+
+
+def _parse_int_list(env: Mapping[str, str], name: str, default: Any, bounds: Optional[Tuple[int, int]]) -> List[int]:
+    # Один проход регуляркой: любые разделители (",", ";", пробелы) допустимы
+    return [int(m) for m in _INT_TOKEN_RE.findall(env.get(name, ""))]
+
+
+_PARSERS: Dict[str, Callable[[Mapping[str, str], str, Any, Optional[Tuple[int, int]]], Any]] = {
+    "str": _parse_str,
+    "opt_str": _parse_opt_str,
+    "int": _parse_int,
+    "int_range": _parse_int_range,
+    "int_list": _parse_int_list,
+}
+
+# (поле Settings, переменная окружения, парсер, default, (min, max))
+_SETTINGS_SPEC: Tuple[Tuple[str, str, str, Any, Optional[Tuple[int, int]]], ...] = (
+    ("bot_token", "BOT_TOKEN", "str", None, None),
+    ("director_tg_id", "DIRECTOR_TG_ID", "int", None, None),
+    ("officer_tg_id", "OFFICER_TG_ID", "int", None, None),
 
-    bot_pin = os.getenv("BOT_PIN")
-    bot_pin = bot_pin.strip() if bot_pin and bot_pin.strip() else None
+    ("bot_pin", "BOT_PIN", "opt_str", None, None),
+    ("superadmin_ids", "SUPERADMIN_IDS", "int_list", None, None),
 
-    journal_path = _get_env_str("JOURNAL_PATH").strip()
+    ("remind_after_minutes", "REMIND_AFTER_MINUTES", "int_range", 30, (1, 1440)),
+    ("remind_repeat_minutes", "REMIND_REPEAT_MINUTES", "int_range", 30, (1, 1440)),
+    ("remind_check_seconds", "REMIND_CHECK_SECONDS", "int_range", 60, (10, 3600)),
 
-    return Settings(
-        bot_token=_get_env_str("BOT_TOKEN"),
-        director_tg_id=_get_env_int("DIRECTOR_TG_ID"),
-        officer_tg_id=_get_env_int("OFFICER_TG_ID"),
+    ("nc_webdav_url", "NC_WEBDAV_URL", "opt_str", "", None),
+    ("nc_user", "NC_USER", "opt_str", "", None),
+    ("nc_app_password", "NC_APP_PASSWORD", "opt_str", "", None),
+    ("journal_path", "JOURNAL_PATH", "opt_str", "", None),
 
-        bot_pin=bot_pin,
-        superadmin_ids=_get_env_int_list("SUPERADMIN_IDS"),
+    ("db_path_raw", "DB_PATH", "opt_str", "bot.db", None),
 
-        remind_after_minutes=_get_int_default("REMIND_AFTER_MINUTES", 30, min_v=1, max_v=1440),
-        remind_repeat_minutes=_get_int_default("REMIND_REPEAT_MINUTES", 30, min_v=1, max_v=1440),
-        remind_check_seconds=_get_int_default("REMIND_CHECK_SECONDS", 60, min_v=10, max_v=3600),
+    ("max_companies_per_request", "MAX_COMPANIES_PER_REQUEST", "int_range", 5, (1, 20)),
+    ("max_purpose_length", "MAX_PURPOSE_LENGTH", "int_range", 500, (50, 2000)),
+    ("max_comment_length", "MAX_COMMENT_LENGTH", "int_range", 300, (0, 2000)),
+)
 
-        nc_webdav_url=_get_env_str("NC_WEBDAV_URL"),
-        nc_user=_get_env_str("NC_USER"),
-        nc_app_password=_get_env_str("NC_APP_PASSWORD"),
-        journal_path=journal_path,
 
-        db_path=db_path,
+# -------------------------
+# Loader
+# -------------------------
+# Настройки читаются из окружения один раз за процесс; повторные вызовы
+# возвращают тот же экземпляр Settings (его не мутируют, поэтому шарить безопасно).
+@lru_cache(maxsize=1)
+def load_settings() -> Settings:
+    # Один снимок окружения вместо десятка обращений к os.environ
+    # (каждое — encode/decode ключа через прокси os._Environ).
+    env: Dict[str, str] = os.environ.copy()
+
+    values: Dict[str, Any] = {}
+    for field_name, env_name, kind, default, bounds in _SETTINGS_SPEC:
+        values[field_name] = _PARSERS[kind](env, env_name, default, bounds)
 
-        max_companies_per_request=_get_int_default("MAX_COMPANIES_PER_REQUEST", 5, min_v=1, max_v=20),
-        max_purpose_length=_get_int_default("MAX_PURPOSE_LENGTH", 500, min_v=50, max_v=2000),
-        max_comment_length=_get_int_default("MAX_COMMENT_LENGTH", 300, min_v=0, max_v=2000),
+    values["journal_enabled"] = bool(
+        values["nc_webdav_url"] and values["nc_user"] and values["nc_app_password"] and values["journal_path"]
+    )
+    values["reminders_enabled"] = bool(
+        values["director_tg_id"]
+        and values["remind_check_seconds"] > 0
+        and values["remind_after_minutes"] > 0
+        and values["remind_repeat_minutes"] > 0
     )
+    return Settings(**values)
@@ -1,12 +1,16 @@
 # db.py
 from __future__ import annotations
 
+import asyncio
+import functools
 import json
 import logging
 import sqlite3
+import time
+from contextlib import asynccontextmanager
 from dataclasses import dataclass
 from pathlib import Path
-from typing import Any, Dict, List, Optional, Tuple
+from typing import Any, AsyncIterator, Dict, Final, List, Optional, Sequence, Tuple
 
 import aiosqlite
 
@@ -23,8 +27,122 @@ from config import (
 
 log = logging.getLogger(__name__)
 
+# PRAGMA user_version: поднимать при добавлении колонок / миграций в init()
+SCHEMA_VERSION = 4
 
-@dataclass
+
+# Порядок совпадает с полями RequestRow: строку собираем позиционно
+_REQUEST_COLS: Tuple[str, ...] = (
+    "id", "tg_id", "username", "company", "token_id", "purpose", "comment", "status",
+    "requested_at", "remind_sent_at", "approved_by", "approved_at",
+    "issued_by", "issued_at", "returned_by", "returned_at",
+)
+_REQUEST_FIELDS = ", ".join(_REQUEST_COLS)
+
+
+def _row_to_request(r: Any) -> RequestRow:
+    return RequestRow(*r)
+
+
+# Префикс _REQUEST_COLS, который выводит карточка (utils.request_card_text)
+_REQUEST_CARD_COLS: Tuple[str, ...] = _REQUEST_COLS[:9]
+_REQUEST_CARD_FIELDS = ", ".join(_REQUEST_CARD_COLS)
+
+
+# Колонки остальных выборок: dict(zip(cols, row)) дешевле dict(sqlite3.Row)
+_TOKEN_COLS: Tuple[str, ...] = ("token_id", "description", "status")
+_TOKEN_FIELDS = ", ".join(_TOKEN_COLS)
+_ITEM_COLS: Tuple[str, ...] = ("company", "token_id")
+_AUDIT_COLS: Tuple[str, ...] = ("id", "ts", "request_id", "actor_tg_id", "action", "payload")
+_AUDIT_FIELDS = ", ".join(_AUDIT_COLS)
+_REQUEST_STATS_COLS: Tuple[str, ...] = ("total", "pending", "approved", "issued", "returned", "rejected")
+_AUTHED_COLS: Tuple[str, ...] = ("tg_id", "authed_at")
+_WAITLIST_COLS: Tuple[str, ...] = ("token_id", "company", "created_at")
+_WAITER_COLS: Tuple[str, ...] = ("id", "tg_id", "token_id", "company")
+
+
+def _rows_to_dicts(cols: Tuple[str, ...], rows: Any) -> List[Dict[str, Any]]:
+    return [dict(zip(cols, r)) for r in rows]
+
+
+# -------------------------
+# SQL (модульные константы: кэш statements sqlite3 ключуется текстом запроса)
+# -------------------------
+_SQL_GET_REQUEST: Final[str] = f"SELECT {_REQUEST_FIELDS} FROM requests WHERE id=?;"
+_SQL_GET_REQUEST_STATUS: Final[str] = "SELECT status FROM requests WHERE id=?;"
+_SQL_GET_REQUEST_ITEMS: Final[str] = "SELECT company, token_id FROM request_items WHERE request_id=? ORDER BY company;"
+_SQL_INSERT_ITEM: Final[str] = "INSERT INTO request_items(request_id, company, token_id) VALUES(?, ?, ?);"
+_SQL_INSERT_AUDIT: Final[str] = "INSERT INTO audit_log(request_id, actor_tg_id, action, payload) VALUES(?, ?, ?, ?);"
+_SQL_GET_TOKEN: Final[str] = f"SELECT {_TOKEN_FIELDS} FROM tokens WHERE token_id=?;"
+_SQL_IS_AUTHED: Final[str] = "SELECT 1 FROM bot_auth WHERE tg_id=?;"
+_SQL_GET_FULL_NAME: Final[str] = "SELECT full_name FROM user_profiles WHERE tg_id=?;"
+
+_SQL_PENDING_OVER: Final[str] = f"""
+    SELECT {_REQUEST_FIELDS} FROM requests
+    WHERE status=? AND requested_at <= DATETIME('now', ?)
+    ORDER BY requested_at ASC;
+"""
+_SQL_STALE_ACTIVE: Final[str] = f"""
+    SELECT {_REQUEST_FIELDS} FROM requests
+    WHERE status IN (?, ?, ?)
+      AND requested_at IS NOT NULL
+      AND requested_at <= DATETIME('now', ?)
+    ORDER BY requested_at ASC;
+"""
+_SQL_PENDING_FOR_REMIND: Final[str] = f"""
+    SELECT {_REQUEST_FIELDS} FROM requests
+    WHERE status=?
+      AND requested_at <= DATETIME('now', ?)
+      AND (
+            remind_sent_at IS NULL OR
+            remind_sent_at <= DATETIME('now', ?)
+      )
+    ORDER BY requested_at ASC;
+"""
+_SQL_STATISTICS: Final[str] = (
+    "SELECT COUNT(*) as total, "
+    "SUM(CASE WHEN status='REQUESTED' THEN 1 ELSE 0 END) as pending, "
+    "SUM(CASE WHEN status='APPROVED' THEN 1 ELSE 0 END) as approved, "
+    "SUM(CASE WHEN status='ISSUED' THEN 1 ELSE 0 END) as issued, "
+    "SUM(CASE WHEN status='RETURNED' THEN 1 ELSE 0 END) as returned, "
+    "SUM(CASE WHEN status='REJECTED' THEN 1 ELSE 0 END) as rejected, "
+    "COUNT(DISTINCT tg_id) as users, "
+    "(SELECT COUNT(*) FROM bot_auth) as authed "
+    "FROM requests;"
+)
+_SQL_TOKEN_STATS: Final[str] = "SELECT status, COUNT(*) as count FROM tokens GROUP BY status;"
+
+
+# Один переиспользуемый энкодер вместо разбора kwargs в каждом json.dumps
+_AUDIT_ENCODER = json.JSONEncoder(ensure_ascii=False, separators=(",", ":"))
+
+
+def _audit_dumps(payload: Dict[str, Any]) -> str:
+    return _AUDIT_ENCODER.encode(payload)
+
+
+# dict в параметрах запроса сериализуется адаптером уже в потоке aiosqlite,
+# а не в event loop (payload'ы аудита передаём как есть)
+sqlite3.register_adapter(dict, _audit_dumps)
+
+
+@functools.lru_cache(maxsize=64)
+def _ago(amount: int, unit: str) -> str:
+    """Модификатор DATETIME('now', ?) вида '-15 minutes'; интервалы повторяются — кэшируем."""
+    return f"-{int(amount)} {unit}"
+
+
+# Безопасный размер IN (...) для SQLITE_MAX_VARIABLE_NUMBER=999
+_MAX_IN_PARAMS = 900
+
+
+@functools.lru_cache(maxsize=64)
+def _placeholders(n: int) -> str:
+    """'?,?,…' для IN (...): одинаковая арность даёт одинаковый текст SQL."""
+    return ",".join("?" * n)
+
+
+@dataclass(slots=True)
 class RequestRow:
     id: int
     tg_id: int
@@ -44,22 +162,181 @@ class RequestRow:
     returned_at: Optional[str]
 
 
+@dataclass(slots=True)
+class RequestCard:
+    """Узкая проекция заявки для списков карточек: без служебных колонок решений."""
+    id: int
+    tg_id: int
+    username: Optional[str]
+    company: str
+    token_id: str
+    purpose: str
+    comment: Optional[str]
+    status: str
+    requested_at: Optional[str]
+
+
+_MISS = object()
+# Ключи снимков, зависящих от статусов заявок/токенов (см. Database._status_cache)
+_COUNTS_KEY = "counts_by_status"
+_STATS_KEY = "statistics"
+_TOKENS_KEY = "all_tokens"
+
+
+class _TTLCache:
+    """
+    Маленький in-process TTL-кэш для горячих точечных чтений.
+    Без блокировок: в asyncio get/set между await не прерываются.
+    Процесс бота один, поэтому инвалидации при записях через Database достаточно.
+    """
+
+    __slots__ = ("_ttl", "_maxsize", "_data")
+
+    def __init__(self, maxsize: int, ttl: float) -> None:
+        self._ttl = ttl
+        self._maxsize = maxsize
+        self._data: Dict[Any, Tuple[float, Any]] = {}
+
+    def get(self, key: Any) -> Any:
+        item = self._data.get(key)
+        if item is None:
+            return _MISS
+        expires, value = item
+        if expires < time.monotonic():
+            self._data.pop(key, None)
+            return _MISS
+        return value
+
+    def set(self, key: Any, value: Any) -> None:
+        if len(self._data) >= self._maxsize and key not in self._data:
+            # Выкидываем самую старую запись (dict хранит порядок вставки)
+            self._data.pop(next(iter(self._data)))
+        self._data[key] = (time.monotonic() + self._ttl, value)
+
+    def pop(self, key: Any) -> None:
+        self._data.pop(key, None)
+
+    def clear(self) -> None:
+        self._data.clear()
+
+
+_PRAGMAS_WRITER: Final[str] = (
+    "PRAGMA journal_mode=WAL;"
+    "PRAGMA synchronous=NORMAL;"
+    "PRAGMA wal_autocheckpoint=1000;"
+)
+_PRAGMAS_COMMON: Final[str] = (
+    "PRAGMA foreign_keys=ON;"
+    "PRAGMA busy_timeout=5000;"
+    # Горячие страницы (tokens/requests и их индексы) держим в памяти
+    "PRAGMA temp_store=MEMORY;"
+    "PRAGMA mmap_size=268435456;"  # 256 MiB
+    "PRAGMA cache_size=-64000;"  # ~64 MiB
+)
+
+
 class Database:
+    """
+    Одно долгоживущее соединение-писатель и небольшой пул read-only
+    соединений для SELECT (у каждого aiosqlite.connect — свой поток, PRAGMA
+    и открытие файлов WAL/SHM, поэтому не переоткрываем).
+    Записи сериализуются через _writer(): иначе BEGIN/COMMIT разных корутин
+    перемешаются на общем соединении. Чтения идут через _reader() и в WAL
+    не ждут писателя.
+    """
+
+    READER_POOL_SIZE = 4
+
     def __init__(self, db_path: str | Path) -> None:
         self.db_path = Path(db_path)
-
-    async def _configure(self, db: aiosqlite.Connection) -> None:
-        db.row_factory = aiosqlite.Row
-        await db.execute("PRAGMA journal_mode=WAL;")
-        await db.execute("PRAGMA synchronous=NORMAL;")
-        await db.execute("PRAGMA foreign_keys=ON;")
-        await db.execute("PRAGMA busy_timeout=5000;")
+        self._db: Optional[aiosqlite.Connection] = None
+        self._reader_conns: List[aiosqlite.Connection] = []
+        self._readers: Optional[asyncio.Queue[aiosqlite.Connection]] = None
+        self._conn_lock = asyncio.Lock()
+        self._write_lock = asyncio.Lock()
+        # is_authed / get_user_full_name дёргаются на каждый апдейт
+        self._auth_cache = _TTLCache(maxsize=4096, ttl=30)
+        # ФИО меняется только через set_user_full_name (write-through), TTL можно держать длинным
+        self._fullname_cache = _TTLCache(maxsize=10_000, ttl=300)
+        # counts_by_status / get_statistics / list_all_tokens: агрегаты для дашбордов,
+        # админки и /tokens; сбрасываются целиком при любой смене статусов
+        self._status_cache = _TTLCache(maxsize=3, ttl=10)
+        # Растёт при каждой записи в requests (создание, смена статуса, удаление)
+        self._requests_epoch = 0
+
+    @property
+    def requests_epoch(self) -> int:
+        """Счётчик изменений таблицы requests: равные значения — изменений не было."""
+        return self._requests_epoch
+
+    def _requests_changed(self) -> None:
+        self._requests_epoch += 1
+        self._status_cache.clear()
+
+    async def _configure(self, db: aiosqlite.Connection, readonly: bool = False) -> None:
+        if not readonly:
+            # Row с доступом по имени — только писателю (транзакции читают row["status"]);
+            # читатели отдают голые кортежи, колонки перечислены в SELECT явно
+            db.row_factory = aiosqlite.Row
+        # Все PRAGMA — одним скриптом: один переход в поток соединения вместо восьми
+        await db.executescript(_PRAGMAS_COMMON if readonly else _PRAGMAS_WRITER + _PRAGMAS_COMMON)
+
+    async def _conn(self) -> aiosqlite.Connection:
+        if self._db is None:
+            async with self._conn_lock:
+                if self._db is None:
+                    self.db_path.parent.mkdir(parents=True, exist_ok=True)
+                    db = await aiosqlite.connect(self.db_path.as_posix(), cached_statements=256)
+                    await self._configure(db)
+                    self._db = db
+        return self._db
+
+    async def _reader_pool(self) -> asyncio.Queue[aiosqlite.Connection]:
+        if self._readers is None:
+            # Писатель создаёт файл и включает WAL — читатели открываются после него
+            await self._conn()
+            async with self._conn_lock:
+                if self._readers is None:
+                    uri = self.db_path.resolve().as_uri() + "?mode=ro"
+                    pool: asyncio.Queue[aiosqlite.Connection] = asyncio.Queue()
+                    for _ in range(self.READER_POOL_SIZE):
+                        db = await aiosqlite.connect(uri, uri=True, cached_statements=256)
+                        await self._configure(db, readonly=True)
+                        self._reader_conns.append(db)
+                        pool.put_nowait(db)
+                    self._readers = pool
+        return self._readers
+
+    @asynccontextmanager
+    async def _writer(self) -> AsyncIterator[aiosqlite.Connection]:
+        db = await self._conn()
+        async with self._write_lock:
+            yield db
+
+    @asynccontextmanager
+    async def _reader(self) -> AsyncIterator[aiosqlite.Connection]:
+        pool = await self._reader_pool()
+        db = await pool.get()
+        try:
+            yield db
+        finally:
+            pool.put_nowait(db)
+
+    async def close(self) -> None:
+        for db in self._reader_conns:
+            await db.close()
+        self._reader_conns.clear()
+        self._readers = None
+        if self._db is not None:
+            try:
+                await self._db.execute("PRAGMA optimize;")
+            except sqlite3.Error as e:
+                log.warning("PRAGMA optimize failed: %s", e)
+            await self._db.close()
+            self._db = None
 
     async def init(self) -> None:
-        self.db_path.parent.mkdir(parents=True, exist_ok=True)
-        async with aiosqlite.connect(self.db_path.as_posix()) as db:
-            await self._configure(db)
-
+        async with self._writer() as db:
             await db.executescript(
                 """
                 CREATE TABLE IF NOT EXISTS tokens(
@@ -132,19 +409,40 @@ class Database:
                 CREATE INDEX IF NOT EXISTS idx_requests_status ON requests(status);
                 CREATE INDEX IF NOT EXISTS idx_requests_tg_id ON requests(tg_id);
                 CREATE INDEX IF NOT EXISTS idx_requests_requested_at ON requests(requested_at);
-                CREATE INDEX IF NOT EXISTS idx_request_items_request_id ON request_items(request_id);
-                CREATE INDEX IF NOT EXISTS idx_audit_request_id ON audit_log(request_id);
+                CREATE INDEX IF NOT EXISTS idx_request_items_rid_company ON request_items(request_id, company, token_id);
+                CREATE INDEX IF NOT EXISTS idx_audit_request_ts ON audit_log(request_id, ts);
+                CREATE INDEX IF NOT EXISTS idx_bot_auth_authed_at ON bot_auth(authed_at);
                 CREATE INDEX IF NOT EXISTS idx_waitlist_token_active ON token_waitlist(token_id, active, created_at);
                 CREATE INDEX IF NOT EXISTS idx_waitlist_user_active ON token_waitlist(tg_id, active, created_at);
+                CREATE INDEX IF NOT EXISTS idx_tokens_status_tokenid ON tokens(status, token_id);
+                CREATE INDEX IF NOT EXISTS idx_audit_ts ON audit_log(ts DESC);
                 """
             )
 
+            cur = await db.execute("PRAGMA user_version;")
+            (version,) = await cur.fetchone()
+            if version >= SCHEMA_VERSION:
+                return
+
             # Мягкие миграции (без молчаливого pass)
             await self._ensure_column(db, "requests", "requested_at", "DATETIME DEFAULT CURRENT_TIMESTAMP")
             await self._ensure_column(db, "requests", "remind_sent_at", "DATETIME")
-
-            await self._seed_tokens_if_empty(db)
+            # v4: индекс по remind_sent_at — только после _ensure_column, иначе старая
+            # таблица requests без этой колонки валит init()
+            await db.execute(
+                "CREATE INDEX IF NOT EXISTS idx_requests_pending_remind "
+                "ON requests(status, requested_at, remind_sent_at);"
+            )
+            # v3: индексы по request_id заменены составными (request_id, ...) выше
+            await db.execute("DROP INDEX IF EXISTS idx_request_items_request_id;")
+            await db.execute("DROP INDEX IF EXISTS idx_audit_request_id;")
+
+            if await self._seed_tokens_if_empty(db):
+                # Свежая база: сразу даём планировщику статистику по индексам
+                await db.execute("ANALYZE;")
+            await db.execute(f"PRAGMA user_version={SCHEMA_VERSION};")
             await db.commit()
+            log.info("Database schema migrated: user_version %s -> %s", version, SCHEMA_VERSION)
 
     async def _ensure_table(self, db: aiosqlite.Connection, name: str, ddl: str) -> None:
         await db.execute(ddl)
@@ -158,11 +456,11 @@ class Database:
         except Exception as e:
             log.warning("Migration ensure_column failed: %s.%s (%s)", table, column, e)
 
-    async def _seed_tokens_if_empty(self, db: aiosqlite.Connection) -> None:
+    async def _seed_tokens_if_empty(self, db: aiosqlite.Connection) -> bool:
         cur = await db.execute("SELECT COUNT(*) AS c FROM tokens;")
         row = await cur.fetchone()
         if row and int(row["c"]) > 0:
-            return
+            return False
 
         from config import COMPANY_TOKEN_MAP, COMPANIES
 
@@ -177,51 +475,68 @@ class Database:
                 "INSERT OR IGNORE INTO tokens(token_id, description, status) VALUES(?, ?, ?);",
                 examples,
             )
+        return True
 
     # -------------------------
     # Internal TX helpers (НЕ открывают новые connect)
     # -------------------------
     async def _get_request_tx(self, db: aiosqlite.Connection, request_id: int) -> Optional[RequestRow]:
-        cur = await db.execute("SELECT * FROM requests WHERE id=?;", (request_id,))
+        cur = await db.execute(_SQL_GET_REQUEST, (request_id,))
         row = await cur.fetchone()
-        return RequestRow(**dict(row)) if row else None
+        return _row_to_request(row) if row else None
 
     async def _get_request_items_tx(self, db: aiosqlite.Connection, request_id: int) -> List[Dict[str, Any]]:
-        cur = await db.execute(
-            "SELECT company, token_id FROM request_items WHERE request_id=? ORDER BY company;",
-            (request_id,),
-        )
-        rows = await cur.fetchall()
-        return [dict(r) for r in rows]
+        rows = await db.execute_fetchall(_SQL_GET_REQUEST_ITEMS, (request_id,))
+        return _rows_to_dicts(_ITEM_COLS, rows)
 
     async def _add_audit_log_tx(
         self, db: aiosqlite.Connection, request_id: int, actor_tg_id: int, action: str, payload: Dict[str, Any]
     ) -> None:
         await db.execute(
-            "INSERT INTO audit_log(request_id, actor_tg_id, action, payload) VALUES(?, ?, ?, ?);",
-            (request_id, actor_tg_id, action, json.dumps(payload, ensure_ascii=False)),
+            _SQL_INSERT_AUDIT,
+            (request_id, actor_tg_id, action, payload),
         )
 
+    async def _set_tokens_status_tx(
+        self, db: aiosqlite.Connection, items: List[Dict[str, Any]], status: str, expected: str
+    ) -> None:
+        """Переводит все токены заявки expected -> status одним UPDATE; иначе TOKEN_STATUS_MISMATCH."""
+        ids = [it["token_id"] for it in items]
+        if not ids:
+            return
+        ph = _placeholders(len(ids))
+        cur = await db.execute(
+            f"UPDATE tokens SET status=? WHERE status=? AND token_id IN ({ph});",
+            (status, expected, *ids),
+        )
+        if cur.rowcount == len(ids):
+            return
+        cur = await db.execute(f"SELECT token_id, status FROM tokens WHERE token_id IN ({ph});", ids)
+        actual = {r["token_id"]: r["status"] for r in await cur.fetchall()}
+        # После частичного UPDATE «правильные» уже получили новый статус
+        offender = next((t for t in ids if actual.get(t) != status), ids[0])
+        raise RuntimeError(f"TOKEN_STATUS_MISMATCH:{offender}")
+
 
     # -------------------------
     # User profile (FIO)
     # -------------------------
     async def get_user_full_name(self, tg_id: int) -> Optional[str]:
-        async with aiosqlite.connect(self.db_path.as_posix()) as db:
-            await self._configure(db)
-            cur = await db.execute("SELECT full_name FROM user_profiles WHERE tg_id=?;", (tg_id,))
+        cached = self._fullname_cache.get(tg_id)
+        if cached is not _MISS:
+            return cached
+        async with self._reader() as db:
+            cur = await db.execute(_SQL_GET_FULL_NAME, (tg_id,))
             row = await cur.fetchone()
-            if not row:
-                return None
-            name = str(row["full_name"] or "").strip()
-            return name or None
+        name = str(row[0] or "").strip() if row else ""
+        self._fullname_cache.set(tg_id, name or None)
+        return name or None
 
     async def set_user_full_name(self, tg_id: int, full_name: str) -> None:
         value = str(full_name or "").strip()
         if not value:
             raise ValueError("full_name is empty")
-        async with aiosqlite.connect(self.db_path.as_posix()) as db:
-            await self._configure(db)
+        async with self._writer() as db:
             await db.execute(
                 "INSERT INTO user_profiles(tg_id, full_name, updated_at) VALUES(?, ?, CURRENT_TIMESTAMP) "
                 "ON CONFLICT(tg_id) DO UPDATE SET full_name=excluded.full_name, updated_at=CURRENT_TIMESTAMP;",
@@ -232,49 +547,53 @@ class Database:
                 (value, tg_id),
             )
             await db.commit()
+        self._fullname_cache.set(tg_id, value)
 
     # -------------------------
     # PIN auth
     # -------------------------
     async def is_authed(self, tg_id: int) -> bool:
-        async with aiosqlite.connect(self.db_path.as_posix()) as db:
-            await self._configure(db)
-            cur = await db.execute("SELECT 1 FROM bot_auth WHERE tg_id=?;", (tg_id,))
-            return (await cur.fetchone()) is not None
+        cached = self._auth_cache.get(tg_id)
+        if cached is not _MISS:
+            return cached
+        async with self._reader() as db:
+            cur = await db.execute(_SQL_IS_AUTHED, (tg_id,))
+            authed = (await cur.fetchone()) is not None
+        self._auth_cache.set(tg_id, authed)
+        return authed
 
     async def set_authed(self, tg_id: int) -> None:
-        async with aiosqlite.connect(self.db_path.as_posix()) as db:
-            await self._configure(db)
+        async with self._writer() as db:
             await db.execute(
                 "INSERT INTO bot_auth(tg_id, authed_at) VALUES(?, CURRENT_TIMESTAMP) "
                 "ON CONFLICT(tg_id) DO UPDATE SET authed_at=CURRENT_TIMESTAMP;",
                 (tg_id,),
             )
             await db.commit()
+        self._auth_cache.set(tg_id, True)
+        self._status_cache.pop(_STATS_KEY)  # authed_count
 
     async def revoke_auth(self, tg_id: int) -> None:
-        async with aiosqlite.connect(self.db_path.as_posix()) as db:
-            await self._configure(db)
+        async with self._writer() as db:
             await db.execute("DELETE FROM bot_auth WHERE tg_id=?;", (tg_id,))
             await db.commit()
+        self._auth_cache.set(tg_id, False)
+        self._status_cache.pop(_STATS_KEY)
 
     async def list_authed_users(self, limit: int = 100) -> List[Dict[str, Any]]:
-        async with aiosqlite.connect(self.db_path.as_posix()) as db:
-            await self._configure(db)
-            cur = await db.execute(
+        async with self._reader() as db:
+            rows = await db.execute_fetchall(
                 "SELECT tg_id, authed_at FROM bot_auth ORDER BY authed_at DESC LIMIT ?;",
                 (limit,),
             )
-            rows = await cur.fetchall()
-            return [dict(r) for r in rows]
+            return _rows_to_dicts(_AUTHED_COLS, rows)
 
     # -------------------------
     # Waitlist (очередь на токены)
     # -------------------------
     async def join_waitlist(self, tg_id: int, token_id: str, company: str) -> bool:
         """Добавляет пользователя в очередь на токен. True — если новая запись/реактивация."""
-        async with aiosqlite.connect(self.db_path.as_posix()) as db:
-            await self._configure(db)
+        async with self._writer() as db:
             cur = await db.execute(
                 "SELECT active FROM token_waitlist WHERE tg_id=? AND token_id=?;",
                 (tg_id, token_id),
@@ -301,15 +620,13 @@ class Database:
             return True
 
     async def list_user_waitlist(self, tg_id: int, limit: int = 50) -> List[Dict[str, Any]]:
-        async with aiosqlite.connect(self.db_path.as_posix()) as db:
-            await self._configure(db)
-            cur = await db.execute(
+        async with self._reader() as db:
+            rows = await db.execute_fetchall(
                 "SELECT token_id, company, created_at FROM token_waitlist "
                 "WHERE tg_id=? AND active=1 ORDER BY created_at ASC LIMIT ?;",
                 (tg_id, limit),
             )
-            rows = await cur.fetchall()
-            return [dict(r) for r in rows]
+            return _rows_to_dicts(_WAITLIST_COLS, rows)
 
     async def pop_waiters_for_available_tokens(self, token_ids: List[str]) -> List[Dict[str, Any]]:
         """Возвращает и деактивирует очередь для освободившихся токенов."""
@@ -320,9 +637,8 @@ class Database:
         if not clean_ids:
             return []
 
-        placeholders = ",".join(["?"] * len(clean_ids))
-        async with aiosqlite.connect(self.db_path.as_posix()) as db:
-            await self._configure(db)
+        placeholders = _placeholders(len(clean_ids))
+        async with self._writer() as db:
             try:
                 await db.execute("BEGIN IMMEDIATE;")
                 cur = await db.execute(
@@ -330,13 +646,13 @@ class Database:
                     f"WHERE active=1 AND token_id IN ({placeholders}) ORDER BY created_at ASC;",
                     clean_ids,
                 )
-                rows = [dict(r) for r in await cur.fetchall()]
+                rows = _rows_to_dicts(_WAITER_COLS, await cur.fetchall())
                 if not rows:
-                    await db.execute("ROLLBACK;")
+                    await db.rollback()
                     return []
 
                 row_ids = [int(r["id"]) for r in rows]
-                placeholders2 = ",".join(["?"] * len(row_ids))
+                placeholders2 = _placeholders(len(row_ids))
                 await db.execute(
                     f"UPDATE token_waitlist SET active=0, notified_at=CURRENT_TIMESTAMP WHERE id IN ({placeholders2});",
                     row_ids,
@@ -344,25 +660,20 @@ class Database:
                 await db.commit()
                 return rows
             except Exception:
-                await db.execute("ROLLBACK;")
+                await db.rollback()
                 raise
 
     # -------------------------
     # Tokens
     # -------------------------
     async def get_token(self, token_id: str) -> Optional[Dict[str, Any]]:
-        async with aiosqlite.connect(self.db_path.as_posix()) as db:
-            await self._configure(db)
-            cur = await db.execute(
-                "SELECT token_id, description, status FROM tokens WHERE token_id=?;",
-                (token_id,),
-            )
+        async with self._reader() as db:
+            cur = await db.execute(_SQL_GET_TOKEN, (token_id,))
             row = await cur.fetchone()
-            return dict(row) if row else None
+            return dict(zip(_TOKEN_COLS, row)) if row else None
 
     async def set_token_status(self, token_id: str, status: str) -> bool:
-        async with aiosqlite.connect(self.db_path.as_posix()) as db:
-            await self._configure(db)
+        async with self._writer() as db:
             cur = await db.execute(
                 "UPDATE tokens SET status=? WHERE token_id=?;",
                 (status, token_id),
@@ -371,21 +682,22 @@ class Database:
             return cur.rowcount > 0
 
     async def list_available_tokens(self) -> List[Dict[str, Any]]:
-        async with aiosqlite.connect(self.db_path.as_posix()) as db:
-            await self._configure(db)
-            cur = await db.execute(
-                "SELECT token_id, description, status FROM tokens WHERE status=? ORDER BY token_id;",
+        async with self._reader() as db:
+            rows = await db.execute_fetchall(
+                f"SELECT {_TOKEN_FIELDS} FROM tokens WHERE status=? ORDER BY token_id;",
                 (TOKEN_AVAILABLE,),
             )
-            rows = await cur.fetchall()
-            return [dict(r) for r in rows]
+            return _rows_to_dicts(_TOKEN_COLS, rows)
 
     async def list_all_tokens(self) -> List[Dict[str, Any]]:
-        async with aiosqlite.connect(self.db_path.as_posix()) as db:
-            await self._configure(db)
-            cur = await db.execute("SELECT token_id, description, status FROM tokens ORDER BY token_id;")
-            rows = await cur.fetchall()
-            return [dict(r) for r in rows]
+        cached = self._status_cache.get(_TOKENS_KEY)
+        if cached is not _MISS:
+            return list(cached)
+        async with self._reader() as db:
+            rows = await db.execute_fetchall(f"SELECT {_TOKEN_FIELDS} FROM tokens ORDER BY token_id;")
+        tokens = _rows_to_dicts(_TOKEN_COLS, rows)
+        self._status_cache.set(_TOKENS_KEY, tokens)
+        return list(tokens)
 
     # -------------------------
     # Requests / Items
@@ -404,19 +716,29 @@ class Database:
             uniq[token_id] = company
         items_u = [(c, t) for t, c in uniq.items()]  # [(company, token_id)]
 
-        async with aiosqlite.connect(self.db_path.as_posix()) as db:
-            await self._configure(db)
+        async with self._writer() as db:
             try:
                 await db.execute("BEGIN IMMEDIATE;")
 
-                # Проверяем и резервируем токены (idempotent)
-                for company, token_id in items_u:
-                    cur = await db.execute("SELECT status FROM tokens WHERE token_id=?;", (token_id,))
-                    row = await cur.fetchone()
-                    if not row:
+                # Проверка + резерв одним запросом: available -> reserved
+                token_ids = [t for _, t in items_u]
+                cur = await db.execute(
+                    f"UPDATE tokens SET status=? WHERE status=? AND token_id IN ({_placeholders(len(token_ids))}) "
+                    "RETURNING token_id;",
+                    (TOKEN_RESERVED, TOKEN_AVAILABLE, *token_ids),
+                )
+                reserved = {r["token_id"] for r in await cur.fetchall()}
+                if len(reserved) != len(token_ids):
+                    missing = [t for t in token_ids if t not in reserved]
+                    cur = await db.execute(
+                        f"SELECT token_id FROM tokens WHERE token_id IN ({_placeholders(len(missing))});",
+                        missing,
+                    )
+                    existing = {r["token_id"] for r in await cur.fetchall()}
+                    token_id = missing[0]
+                    if token_id not in existing:
                         raise RuntimeError(f"TOKEN_NOT_FOUND:{token_id}")
-                    if row["status"] != TOKEN_AVAILABLE:
-                        raise RuntimeError(f"TOKEN_NOT_AVAILABLE:{token_id}")
+                    raise RuntimeError(f"TOKEN_NOT_AVAILABLE:{token_id}")
 
                 # Создаём заявку
                 cur = await db.execute(
@@ -429,20 +751,10 @@ class Database:
                 request_id = int(cur.lastrowid)
 
                 # Items
-                for company, token_id in items_u:
-                    await db.execute(
-                        "INSERT INTO request_items(request_id, company, token_id) VALUES(?, ?, ?);",
-                        (request_id, company, token_id),
-                    )
-
-                # Reserve tokens строго из available -> reserved
-                for company, token_id in items_u:
-                    cur2 = await db.execute(
-                        "UPDATE tokens SET status=? WHERE token_id=? AND status=?;",
-                        (TOKEN_RESERVED, token_id, TOKEN_AVAILABLE),
-                    )
-                    if cur2.rowcount != 1:
-                        raise RuntimeError(f"TOKEN_RESERVE_FAILED:{token_id}")
+                await db.executemany(
+                    _SQL_INSERT_ITEM,
+                    [(request_id, company, token_id) for company, token_id in items_u],
+                )
 
                 await self._add_audit_log_tx(
                     db=db,
@@ -453,47 +765,70 @@ class Database:
                 )
 
                 await db.commit()
+                self._requests_changed()
                 return request_id
 
             except sqlite3.Error as e:
-                await db.execute("ROLLBACK;")
+                await db.rollback()
                 raise RuntimeError(f"DB_ERROR:{e}") from e
             except Exception:
-                await db.execute("ROLLBACK;")
+                await db.rollback()
                 raise
 
     async def get_request(self, request_id: int) -> Optional[RequestRow]:
-        async with aiosqlite.connect(self.db_path.as_posix()) as db:
-            await self._configure(db)
+        async with self._reader() as db:
             return await self._get_request_tx(db, request_id)
 
     async def get_request_items(self, request_id: int) -> List[Dict[str, Any]]:
-        async with aiosqlite.connect(self.db_path.as_posix()) as db:
-            await self._configure(db)
+        async with self._reader() as db:
             return await self._get_request_items_tx(db, request_id)
 
+    async def get_request_items_bulk(self, request_ids: List[int]) -> Dict[int, List[Dict[str, Any]]]:
+        """Позиции сразу для нескольких заявок (вместо N вызовов get_request_items)."""
+        result: Dict[int, List[Dict[str, Any]]] = {int(rid): [] for rid in request_ids}
+        if not result:
+            return result
+        ids = list(result)
+        async with self._reader() as db:
+            for i in range(0, len(ids), _MAX_IN_PARAMS):
+                chunk = ids[i : i + _MAX_IN_PARAMS]
+                rows = await db.execute_fetchall(
+                    "SELECT request_id, company, token_id FROM request_items "
+                    f"WHERE request_id IN ({_placeholders(len(chunk))}) ORDER BY request_id, company;",
+                    chunk,
+                )
+                for request_id, company, token_id in rows:
+                    result[request_id].append({"company": company, "token_id": token_id})
+        return result
+
     async def list_requests_by_tg(self, tg_id: int, limit: int = 50) -> List[RequestRow]:
-        async with aiosqlite.connect(self.db_path.as_posix()) as db:
-            await self._configure(db)
-            cur = await db.execute(
-                "SELECT * FROM requests WHERE tg_id=? ORDER BY id DESC LIMIT ?;",
+        async with self._reader() as db:
+            rows = await db.execute_fetchall(
+                f"SELECT {_REQUEST_FIELDS} FROM requests WHERE tg_id=? ORDER BY id DESC LIMIT ?;",
                 (tg_id, limit),
             )
-            rows = await cur.fetchall()
-            return [RequestRow(**dict(r)) for r in rows]
+            return [_row_to_request(r) for r in rows]
 
     async def list_requests_by_user(self, tg_id: int, limit: int = 50) -> List[RequestRow]:
         return await self.list_requests_by_tg(tg_id, limit)
 
     async def list_requests_by_status(self, status: str, limit: int = 50) -> List[RequestRow]:
-        async with aiosqlite.connect(self.db_path.as_posix()) as db:
-            await self._configure(db)
-            cur = await db.execute(
-                "SELECT * FROM requests WHERE status=? ORDER BY id DESC LIMIT ?;",
+        async with self._reader() as db:
+            rows = await db.execute_fetchall(
+                f"SELECT {_REQUEST_FIELDS} FROM requests WHERE status=? ORDER BY id DESC LIMIT ?;",
                 (status, limit),
             )
-            rows = await cur.fetchall()
-            return [RequestRow(**dict(r)) for r in rows]
+            return [_row_to_request(r) for r in rows]
+
+    async def list_request_cards(self, statuses: Sequence[str] = (), limit: int = 20) -> List[RequestCard]:
+        """Последние заявки (в любом из statuses, пустой — все) только с полями карточки."""
+        where = f"WHERE status IN ({_placeholders(len(statuses))}) " if statuses else ""
+        async with self._reader() as db:
+            rows = await db.execute_fetchall(
+                f"SELECT {_REQUEST_CARD_FIELDS} FROM requests {where}ORDER BY id DESC LIMIT ?;",
+                (*statuses, limit),
+            )
+            return [RequestCard(*r) for r in rows]
 
     async def list_pending_for_director(self, limit: int = 50) -> List[RequestRow]:
         return await self.list_requests_by_status(STATUS_REQUESTED, limit)
@@ -502,124 +837,96 @@ class Database:
         return await self.list_requests_by_status(STATUS_APPROVED, limit)
 
     async def list_last_requests(self, limit: int = 20) -> List[RequestRow]:
-        async with aiosqlite.connect(self.db_path.as_posix()) as db:
-            await self._configure(db)
-            cur = await db.execute("SELECT * FROM requests ORDER BY id DESC LIMIT ?;", (limit,))
-            rows = await cur.fetchall()
-            return [RequestRow(**dict(r)) for r in rows]
+        async with self._reader() as db:
+            rows = await db.execute_fetchall(
+                f"SELECT {_REQUEST_FIELDS} FROM requests ORDER BY id DESC LIMIT ?;", (limit,)
+            )
+            return [_row_to_request(r) for r in rows]
 
     async def counts_by_status(self) -> Dict[str, int]:
-        async with aiosqlite.connect(self.db_path.as_posix()) as db:
-            await self._configure(db)
-            cur = await db.execute("SELECT status, COUNT(*) AS c FROM requests GROUP BY status;")
-            rows = await cur.fetchall()
-            return {r["status"]: int(r["c"]) for r in rows}
+        cached = self._status_cache.get(_COUNTS_KEY)
+        if cached is not _MISS:
+            return dict(cached)
+        async with self._reader() as db:
+            rows = await db.execute_fetchall("SELECT status, COUNT(*) AS c FROM requests GROUP BY status;")
+        counts = {status: int(c) for status, c in rows}
+        self._status_cache.set(_COUNTS_KEY, counts)
+        return dict(counts)
 
     async def pending_over_seconds(self, seconds: int) -> List[RequestRow]:
-        async with aiosqlite.connect(self.db_path.as_posix()) as db:
-            await self._configure(db)
-            cur = await db.execute(
-                """
-                SELECT * FROM requests
-                WHERE status=? AND requested_at <= DATETIME('now', ?)
-                ORDER BY requested_at ASC;
-                """,
-                (STATUS_REQUESTED, f"-{int(seconds)} seconds"),
+        async with self._reader() as db:
+            rows = await db.execute_fetchall(
+                _SQL_PENDING_OVER, (STATUS_REQUESTED, _ago(seconds, "seconds"))
             )
-            rows = await cur.fetchall()
-            return [RequestRow(**dict(r)) for r in rows]
+            return [_row_to_request(r) for r in rows]
 
     async def stale_active_requests_over_seconds(self, seconds: int) -> List[RequestRow]:
         """Заявки, которые долго находятся в активных статусах и требуют внимания."""
-        async with aiosqlite.connect(self.db_path.as_posix()) as db:
-            await self._configure(db)
-            cur = await db.execute(
-                """
-                SELECT * FROM requests
-                WHERE status IN (?, ?, ?)
-                  AND requested_at IS NOT NULL
-                  AND requested_at <= DATETIME('now', ?)
-                ORDER BY requested_at ASC;
-                """,
-                (STATUS_REQUESTED, STATUS_APPROVED, STATUS_ISSUED, f"-{int(seconds)} seconds"),
+        async with self._reader() as db:
+            rows = await db.execute_fetchall(
+                _SQL_STALE_ACTIVE,
+                (STATUS_REQUESTED, STATUS_APPROVED, STATUS_ISSUED, _ago(seconds, "seconds")),
             )
-            rows = await cur.fetchall()
-            return [RequestRow(**dict(r)) for r in rows]
+            return [_row_to_request(r) for r in rows]
 
     async def pending_for_remind(self, after_minutes: int, repeat_minutes: int) -> List[RequestRow]:
-        async with aiosqlite.connect(self.db_path.as_posix()) as db:
-            await self._configure(db)
-            cur = await db.execute(
-                """
-                SELECT * FROM requests
-                WHERE status=? 
-                  AND requested_at <= DATETIME('now', ?)
-                  AND (
-                        remind_sent_at IS NULL OR
-                        remind_sent_at <= DATETIME('now', ?)
-                  )
-                ORDER BY requested_at ASC;
-                """,
+        async with self._reader() as db:
+            rows = await db.execute_fetchall(
+                _SQL_PENDING_FOR_REMIND,
                 (
                     STATUS_REQUESTED,
-                    f"-{int(after_minutes)} minutes",
-                    f"-{int(repeat_minutes)} minutes",
+                    _ago(after_minutes, "minutes"),
+                    _ago(repeat_minutes, "minutes"),
                 ),
             )
-            rows = await cur.fetchall()
-            return [RequestRow(**dict(r)) for r in rows]
+            return [_row_to_request(r) for r in rows]
 
     async def mark_reminded(self, request_ids: List[int]) -> None:
         if not request_ids:
             return
-        placeholders = ",".join(["?"] * len(request_ids))
-        async with aiosqlite.connect(self.db_path.as_posix()) as db:
-            await self._configure(db)
-            await db.execute(
-                f"UPDATE requests SET remind_sent_at=CURRENT_TIMESTAMP WHERE id IN ({placeholders});",
-                request_ids,
-            )
+        async with self._writer() as db:
+            # Пачками: не упираемся в SQLITE_MAX_VARIABLE_NUMBER (999 на старых сборках)
+            for i in range(0, len(request_ids), _MAX_IN_PARAMS):
+                chunk = request_ids[i : i + _MAX_IN_PARAMS]
+                await db.execute(
+                    f"UPDATE requests SET remind_sent_at=CURRENT_TIMESTAMP WHERE id IN ({_placeholders(len(chunk))});",
+                    chunk,
+                )
             await db.commit()
 
     # -------------------------
     # Status transitions (director/officer) — безопасно и атомарно
     # -------------------------
+    # Без BEGIN IMMEDIATE: первым идёт условный UPDATE ... WHERE status=?,
+    # он сам берёт write-lock неявной транзакции и служит compare-and-set.
+    async def _transition_missed_tx(self, db: aiosqlite.Connection, request_id: int) -> None:
+        """UPDATE не нашёл строку: заявки нет (None) или статус уже другой (INVALID_STATUS)."""
+        cur = await db.execute(_SQL_GET_REQUEST_STATUS, (request_id,))
+        row = await cur.fetchone()
+        await db.rollback()
+        if row:
+            raise RuntimeError("INVALID_STATUS")
+        return None
+
     async def director_decide(self, request_id: int, director_tg_id: int, approve: bool) -> Optional[RequestRow]:
         new_status = STATUS_APPROVED if approve else STATUS_REJECTED
 
-        async with aiosqlite.connect(self.db_path.as_posix()) as db:
-            await self._configure(db)
+        async with self._writer() as db:
             try:
-                await db.execute("BEGIN IMMEDIATE;")
-
-                cur = await db.execute("SELECT status FROM requests WHERE id=?;", (request_id,))
-                row = await cur.fetchone()
-                if not row:
-                    await db.execute("ROLLBACK;")
-                    return None
-                if row["status"] != STATUS_REQUESTED:
-                    await db.execute("ROLLBACK;")
-                    raise RuntimeError("INVALID_STATUS")
-
                 # Переход REQUESTED -> APPROVED/REJECTED (защита от повторных кликов)
                 cur2 = await db.execute(
                     "UPDATE requests SET status=?, approved_by=?, approved_at=CURRENT_TIMESTAMP "
-                    "WHERE id=? AND status=?;",
+                    f"WHERE id=? AND status=? RETURNING {_REQUEST_FIELDS};",
                     (new_status, director_tg_id, request_id, STATUS_REQUESTED),
                 )
-                if cur2.rowcount != 1:
-                    raise RuntimeError("RACE_LOST")
+                updated = await cur2.fetchall()
+                if not updated:
+                    return await self._transition_missed_tx(db, request_id)
 
                 # Токены: все должны быть reserved; если отказ — вернуть в available
                 items = await self._get_request_items_tx(db, request_id)
                 want = TOKEN_RESERVED if approve else TOKEN_AVAILABLE
-                for it in items:
-                    cur3 = await db.execute(
-                        "UPDATE tokens SET status=? WHERE token_id=? AND status=?;",
-                        (want, it["token_id"], TOKEN_RESERVED),
-                    )
-                    if cur3.rowcount != 1:
-                        raise RuntimeError(f"TOKEN_STATUS_MISMATCH:{it['token_id']}")
+                await self._set_tokens_status_tx(db, items, want, TOKEN_RESERVED)
 
                 await self._add_audit_log_tx(
                     db=db,
@@ -630,43 +937,27 @@ class Database:
                 )
 
                 await db.commit()
-                return await self._get_request_tx(db, request_id)
+                self._requests_changed()
+                return _row_to_request(updated[0])
 
             except Exception:
-                await db.execute("ROLLBACK;")
+                await db.rollback()
                 raise
 
     async def officer_issue(self, request_id: int, officer_tg_id: int) -> Optional[RequestRow]:
-        async with aiosqlite.connect(self.db_path.as_posix()) as db:
-            await self._configure(db)
+        async with self._writer() as db:
             try:
-                await db.execute("BEGIN IMMEDIATE;")
-
-                cur = await db.execute("SELECT status FROM requests WHERE id=?;", (request_id,))
-                row = await cur.fetchone()
-                if not row:
-                    await db.execute("ROLLBACK;")
-                    return None
-                if row["status"] != STATUS_APPROVED:
-                    await db.execute("ROLLBACK;")
-                    raise RuntimeError("INVALID_STATUS")
-
                 cur2 = await db.execute(
                     "UPDATE requests SET status=?, issued_by=?, issued_at=CURRENT_TIMESTAMP "
-                    "WHERE id=? AND status=?;",
+                    f"WHERE id=? AND status=? RETURNING {_REQUEST_FIELDS};",
                     (STATUS_ISSUED, officer_tg_id, request_id, STATUS_APPROVED),
                 )
-                if cur2.rowcount != 1:
-                    raise RuntimeError("RACE_LOST")
+                updated = await cur2.fetchall()
+                if not updated:
+                    return await self._transition_missed_tx(db, request_id)
 
                 items = await self._get_request_items_tx(db, request_id)
-                for it in items:
-                    cur3 = await db.execute(
-                        "UPDATE tokens SET status=? WHERE token_id=? AND status=?;",
-                        (TOKEN_ISSUED, it["token_id"], TOKEN_RESERVED),
-                    )
-                    if cur3.rowcount != 1:
-                        raise RuntimeError(f"TOKEN_STATUS_MISMATCH:{it['token_id']}")
+                await self._set_tokens_status_tx(db, items, TOKEN_ISSUED, TOKEN_RESERVED)
 
                 await self._add_audit_log_tx(
                     db=db,
@@ -677,43 +968,27 @@ class Database:
                 )
 
                 await db.commit()
-                return await self._get_request_tx(db, request_id)
+                self._requests_changed()
+                return _row_to_request(updated[0])
 
             except Exception:
-                await db.execute("ROLLBACK;")
+                await db.rollback()
                 raise
 
     async def officer_return(self, request_id: int, officer_tg_id: int) -> Optional[RequestRow]:
-        async with aiosqlite.connect(self.db_path.as_posix()) as db:
-            await self._configure(db)
+        async with self._writer() as db:
             try:
-                await db.execute("BEGIN IMMEDIATE;")
-
-                cur = await db.execute("SELECT status FROM requests WHERE id=?;", (request_id,))
-                row = await cur.fetchone()
-                if not row:
-                    await db.execute("ROLLBACK;")
-                    return None
-                if row["status"] != STATUS_ISSUED:
-                    await db.execute("ROLLBACK;")
-                    raise RuntimeError("INVALID_STATUS")
-
                 cur2 = await db.execute(
                     "UPDATE requests SET status=?, returned_by=?, returned_at=CURRENT_TIMESTAMP "
-                    "WHERE id=? AND status=?;",
+                    f"WHERE id=? AND status=? RETURNING {_REQUEST_FIELDS};",
                     (STATUS_RETURNED, officer_tg_id, request_id, STATUS_ISSUED),
                 )
-                if cur2.rowcount != 1:
-                    raise RuntimeError("RACE_LOST")
+                updated = await cur2.fetchall()
+                if not updated:
+                    return await self._transition_missed_tx(db, request_id)
 
                 items = await self._get_request_items_tx(db, request_id)
-                for it in items:
-                    cur3 = await db.execute(
-                        "UPDATE tokens SET status=? WHERE token_id=? AND status=?;",
-                        (TOKEN_AVAILABLE, it["token_id"], TOKEN_ISSUED),
-                    )
-                    if cur3.rowcount != 1:
-                        raise RuntimeError(f"TOKEN_STATUS_MISMATCH:{it['token_id']}")
+                await self._set_tokens_status_tx(db, items, TOKEN_AVAILABLE, TOKEN_ISSUED)
 
                 await self._add_audit_log_tx(
                     db=db,
@@ -724,88 +999,80 @@ class Database:
                 )
 
                 await db.commit()
-                return await self._get_request_tx(db, request_id)
+                self._requests_changed()
+                return _row_to_request(updated[0])
 
             except Exception:
-                await db.execute("ROLLBACK;")
+                await db.rollback()
                 raise
 
     # -------------------------
     # Audit
     # -------------------------
     async def add_audit_log(self, request_id: int, actor_tg_id: int, action: str, payload: Dict[str, Any]) -> None:
-        async with aiosqlite.connect(self.db_path.as_posix()) as db:
-            await self._configure(db)
+        async with self._writer() as db:
             await db.execute(
-                "INSERT INTO audit_log(request_id, actor_tg_id, action, payload) VALUES(?, ?, ?, ?);",
-                (request_id, actor_tg_id, action, json.dumps(payload, ensure_ascii=False)),
+                _SQL_INSERT_AUDIT,
+                (request_id, actor_tg_id, action, payload),
             )
             await db.commit()
 
     async def get_audit_logs(self, request_id: Optional[int] = None, limit: int = 50) -> List[Dict[str, Any]]:
-        async with aiosqlite.connect(self.db_path.as_posix()) as db:
-            await self._configure(db)
+        async with self._reader() as db:
             if request_id is not None:
-                cur = await db.execute(
-                    "SELECT * FROM audit_log WHERE request_id=? ORDER BY ts DESC LIMIT ?;",
+                rows = await db.execute_fetchall(
+                    f"SELECT {_AUDIT_FIELDS} FROM audit_log WHERE request_id=? ORDER BY ts DESC LIMIT ?;",
                     (request_id, limit),
                 )
             else:
-                cur = await db.execute("SELECT * FROM audit_log ORDER BY ts DESC LIMIT ?;", (limit,))
-            rows = await cur.fetchall()
-            return [dict(r) for r in rows]
+                rows = await db.execute_fetchall(
+                    f"SELECT {_AUDIT_FIELDS} FROM audit_log ORDER BY ts DESC LIMIT ?;", (limit,)
+                )
+            return _rows_to_dicts(_AUDIT_COLS, rows)
 
     # -------------------------
     # Admin functions
     # -------------------------
     async def get_statistics(self) -> Dict[str, Any]:
-        async with aiosqlite.connect(self.db_path.as_posix()) as db:
-            await self._configure(db)
-
-            cur = await db.execute(
-                "SELECT COUNT(*) as total, "
-                "SUM(CASE WHEN status='REQUESTED' THEN 1 ELSE 0 END) as pending, "
-                "SUM(CASE WHEN status='APPROVED' THEN 1 ELSE 0 END) as approved, "
-                "SUM(CASE WHEN status='ISSUED' THEN 1 ELSE 0 END) as issued, "
-                "SUM(CASE WHEN status='RETURNED' THEN 1 ELSE 0 END) as returned, "
-                "SUM(CASE WHEN status='REJECTED' THEN 1 ELSE 0 END) as rejected "
-                "FROM requests;"
-            )
-            req_stats = dict(await cur.fetchone())
-
-            cur = await db.execute("SELECT status, COUNT(*) as count FROM tokens GROUP BY status;")
-            token_stats = {row["status"]: row["count"] for row in await cur.fetchall()}
-
-            cur = await db.execute("SELECT COUNT(DISTINCT tg_id) as users FROM requests;")
-            users_count = (await cur.fetchone())["users"]
-
-            cur = await db.execute("SELECT COUNT(*) as authed FROM bot_auth;")
-            authed_count = (await cur.fetchone())["authed"]
-
-            return {
-                "requests": req_stats,
-                "tokens": token_stats,
-                "users_count": users_count,
-                "authed_count": authed_count,
-            }
+        """Снимок кэшируется на несколько секунд — результат только для чтения."""
+        cached = self._status_cache.get(_STATS_KEY)
+        if cached is not _MISS:
+            return cached
+        async with self._reader() as db:
+            rows = await db.execute_fetchall(_SQL_STATISTICS)
+            *counts, users_count, authed_count = rows[0]
+            req_stats = dict(zip(_REQUEST_STATS_COLS, counts))
+
+            rows = await db.execute_fetchall(_SQL_TOKEN_STATS)
+            token_stats = {status: count for status, count in rows}
+
+        stats = {
+            "requests": req_stats,
+            "tokens": token_stats,
+            "users_count": users_count,
+            "authed_count": authed_count,
+        }
+        self._status_cache.set(_STATS_KEY, stats)
+        return stats
 
     async def delete_request_by_admin(self, request_id: int, actor_tg_id: int) -> bool:
-        async with aiosqlite.connect(self.db_path.as_posix()) as db:
-            await self._configure(db)
+        async with self._writer() as db:
             try:
                 await db.execute("BEGIN IMMEDIATE;")
 
                 req = await self._get_request_tx(db, request_id)
                 if not req:
-                    await db.execute("ROLLBACK;")
+                    await db.rollback()
                     return False
 
                 items = await self._get_request_items_tx(db, request_id)
-                for it in items:
-                    await db.execute(
-                        "UPDATE tokens SET status=? WHERE token_id=? AND status IN (?, ?, ?);",
-                        (TOKEN_AVAILABLE, it["token_id"], TOKEN_RESERVED, TOKEN_ISSUED, TOKEN_AVAILABLE),
-                    )
+                await db.executemany(
+                    "UPDATE tokens SET status=? WHERE token_id=? AND status IN (?, ?, ?);",
+                    [
+                        (TOKEN_AVAILABLE, it["token_id"], TOKEN_RESERVED, TOKEN_ISSUED, TOKEN_AVAILABLE)
+                        for it in items
+                    ],
+                )
 
                 payload = {
                     "deleted_request_id": request_id,
@@ -815,34 +1082,42 @@ class Database:
                 }
                 await db.execute(
                     "INSERT INTO audit_log(request_id, actor_tg_id, action, payload) VALUES(NULL, ?, ?, ?);",
-                    (actor_tg_id, "ADMIN_DELETE_REQUEST", json.dumps(payload, ensure_ascii=False)),
+                    (actor_tg_id, "ADMIN_DELETE_REQUEST", payload),
                 )
 
                 await db.execute("DELETE FROM audit_log WHERE request_id=?;", (request_id,))
                 await db.execute("DELETE FROM requests WHERE id=?;", (request_id,))
                 await db.commit()
+                self._requests_changed()
                 return True
             except Exception:
-                await db.execute("ROLLBACK;")
+                await db.rollback()
                 raise
 
     async def cleanup_old_data(self, days: int = 90) -> int:
-        async with aiosqlite.connect(self.db_path.as_posix()) as db:
-            await self._configure(db)
-
-            cur = await db.execute(
-                "SELECT id FROM requests WHERE status IN ('RETURNED','REJECTED') "
-                "AND requested_at <= DATETIME('now', ?);",
-                (f"-{days} days",),
-            )
-            old_ids = [row["id"] for row in await cur.fetchall()]
-            if not old_ids:
-                return 0
-
-            placeholders = ",".join(["?"] * len(old_ids))
-            await db.execute("BEGIN IMMEDIATE;")
-            await db.execute(f"DELETE FROM request_items WHERE request_id IN ({placeholders});", old_ids)
-            await db.execute(f"DELETE FROM audit_log WHERE request_id IN ({placeholders});", old_ids)
-            await db.execute(f"DELETE FROM requests WHERE id IN ({placeholders});", old_ids)
-            await db.commit()
-            return len(old_ids)
+        async with self._writer() as db:
+            try:
+                await db.execute("BEGIN IMMEDIATE;")
+                # id во временной таблице: без лимита на число параметров, DELETE идут join'ом
+                await db.execute("CREATE TEMP TABLE IF NOT EXISTS _cleanup_ids(id INTEGER PRIMARY KEY);")
+                await db.execute("DELETE FROM _cleanup_ids;")
+                cur = await db.execute(
+                    "INSERT INTO _cleanup_ids(id) SELECT id FROM requests "
+                    "WHERE status IN ('RETURNED','REJECTED') AND requested_at <= DATETIME('now', ?);",
+                    (_ago(days, "days"),),
+                )
+                removed = cur.rowcount
+                if removed <= 0:
+                    await db.rollback()
+                    return 0
+
+                await db.execute("DELETE FROM request_items WHERE request_id IN (SELECT id FROM _cleanup_ids);")
+                await db.execute("DELETE FROM audit_log WHERE request_id IN (SELECT id FROM _cleanup_ids);")
+                await db.execute("DELETE FROM requests WHERE id IN (SELECT id FROM _cleanup_ids);")
+                await db.execute("DELETE FROM _cleanup_ids;")
+                await db.commit()
+                self._requests_changed()
+                return removed
+            except Exception:
+                await db.rollback()
+                raise
@@ -1,10 +1,14 @@
 # handlers.py
 from __future__ import annotations
 
+import asyncio
+import functools
+import itertools
 import logging
-from typing import Any, Optional, Set, List, Dict
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Set, Tuple
 
-from aiogram import F, Router
+from aiogram import BaseMiddleware, F, Router
 from aiogram.filters import Command, CommandStart
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
@@ -19,10 +23,13 @@ from aiogram.types import (
 )
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 
-from config import COMPANIES, COMPANY_TOKEN_MAP, TOKEN_AVAILABLE
+from config import COMPANIES, COMPANY_TOKEN_MAP, TOKEN_AVAILABLE, TOKEN_COMPANY_MAP
 from db import Database
 from utils import (
-    append_journal_row,
+    CB_PREFIX,
+    TG_SEND_LIMITER,
+    JournalEntry,
+    append_journal_rows,
     kb_director_decision,
     kb_officer_actions,
     request_card_text,
@@ -42,6 +49,28 @@ from utils import (
 log = logging.getLogger(__name__)
 router = Router()
 
+
+class CallbackActionMiddleware(BaseMiddleware):
+    """
+    Разбирает callback_data один раз на входе в роутер:
+    хендлеры получают готовые cb_action/cb_value (None, если данные чужие/битые).
+    """
+
+    async def __call__(
+        self,
+        handler: Callable[[Any, Dict[str, Any]], Awaitable[Any]],
+        event: CallbackQuery,
+        data: Dict[str, Any],
+    ) -> Any:
+        try:
+            data["cb_action"], data["cb_value"] = unpack_cb(event.data)
+        except ValueError:
+            data["cb_action"] = data["cb_value"] = None
+        return await handler(event, data)
+
+
+router.callback_query.outer_middleware(CallbackActionMiddleware())
+
 # -------------------------
 # Меню
 # -------------------------
@@ -55,39 +84,44 @@ BTN_TOKENS = "🔑 Статусы токенов"
 BTN_CANCEL = "❌ Отмена"
 
 
-def main_menu_kb() -> ReplyKeyboardMarkup:
-    return ReplyKeyboardMarkup(
-        keyboard=[
-            [KeyboardButton(text=BTN_REQUEST)],
-            [KeyboardButton(text=BTN_MY)],
-            [KeyboardButton(text=BTN_PENDING)],
-            [KeyboardButton(text=BTN_ACTIVE)],
-            [KeyboardButton(text=BTN_HELP), KeyboardButton(text=BTN_PROFILE)],
-            [KeyboardButton(text=BTN_TOKENS)],
-            [KeyboardButton(text=BTN_CANCEL)],
-        ],
-        resize_keyboard=True,
-        one_time_keyboard=False,
-        input_field_placeholder="Выберите действие…",
-    )
+# Клавиатура и справка статичны — собираем один раз при импорте
+MAIN_MENU_KB = ReplyKeyboardMarkup(
+    keyboard=[
+        [KeyboardButton(text=BTN_REQUEST)],
+        [KeyboardButton(text=BTN_MY)],
+        [KeyboardButton(text=BTN_PENDING)],
+        [KeyboardButton(text=BTN_ACTIVE)],
+        [KeyboardButton(text=BTN_HELP), KeyboardButton(text=BTN_PROFILE)],
+        [KeyboardButton(text=BTN_TOKENS)],
+        [KeyboardButton(text=BTN_CANCEL)],
+    ],
+    resize_keyboard=True,
+    one_time_keyboard=False,
+    input_field_placeholder="Выберите действие…",
+)
 
+HELP_TEXT = (
+    "📋 <b>Как пользоваться ботом:</b>\n\n"
+    f"• <b>{BTN_REQUEST}</b> — оформить заявку (можно выбрать несколько компаний)\n"
+    f"• <b>{BTN_MY}</b> — просмотреть свои заявки\n"
+    f"• <b>{BTN_PENDING}</b> — раздел для директора (согласование заявок)\n"
+    f"• <b>{BTN_ACTIVE}</b> — раздел для уполномоченного (выдача/приём токенов)\n"
+    f"• <b>{BTN_HELP}</b> — показать эту справку\n"
+    f"• <b>{BTN_PROFILE}</b> — заполнить/обновить ФИО\n"
+    f"• <b>{BTN_TOKENS}</b> — посмотреть какие токены свободны/заняты\n"
+    "• <b>/tokens</b> — то же действие командой\n"
+    "• Если токен занят, вы автоматически встанете в очередь и получите уведомление, когда он освободится\n"
+    "• <b>/profile</b> — то же действие командой\n"
+    f"• <b>{BTN_CANCEL}</b> — отменить текущее действие\n\n"
+    "Если что-то не получается — напишите системному администратору."
+)
 
-def help_text() -> str:
-    return (
-        "📋 <b>Как пользоваться ботом:</b>\n\n"
-        f"• <b>{BTN_REQUEST}</b> — оформить заявку (можно выбрать несколько компаний)\n"
-        f"• <b>{BTN_MY}</b> — просмотреть свои заявки\n"
-        f"• <b>{BTN_PENDING}</b> — раздел для директора (согласование заявок)\n"
-        f"• <b>{BTN_ACTIVE}</b> — раздел для уполномоченного (выдача/приём токенов)\n"
-        f"• <b>{BTN_HELP}</b> — показать эту справку\n"
-        f"• <b>{BTN_PROFILE}</b> — заполнить/обновить ФИО\n"
-        f"• <b>{BTN_TOKENS}</b> — посмотреть какие токены свободны/заняты\n"
-        "• <b>/tokens</b> — то же действие командой\n"
-        "• Если токен занят, вы автоматически встанете в очередь и получите уведомление, когда он освободится\n"
-        "• <b>/profile</b> — то же действие командой\n"
-        f"• <b>{BTN_CANCEL}</b> — отменить текущее действие\n\n"
-        "Если что-то не получается — напишите системному администратору."
-    )
+WELCOME_TEXT = (
+    "👋 <b>Приветствуем в системе учёта USB-носителей с ЭЦП!</b>\n\n"
+    "Я помогу вам управлять заявками на выдачу токенов для подписи документов.\n\n"
+    "Для начала работы используйте кнопки меню ниже."
+)
+START_TEXT = WELCOME_TEXT + "\n\n" + HELP_TEXT
 
 
 # -------------------------
@@ -102,21 +136,40 @@ class RequestFSM(StatesGroup):
 # -------------------------
 # Helpers
 # -------------------------
-def kb_companies_multi(selected_idx: Set[int], max_selection: int = 5) -> InlineKeyboardMarkup:
+_SEPARATOR_LINE = "—" * 20
+_CARD_WITH_SEPARATOR = "{}\n" + _SEPARATOR_LINE
+
+
+def _cards_text(header: str, rows: List[Any], items_map: Dict[int, List[Dict[str, Any]]]) -> str:
+    """Заголовок + карточки заявок, каждая с разделителем снизу."""
+    parts = [header]
+    parts.extend(_CARD_WITH_SEPARATOR.format(request_card_text(r, items_map[r.id])) for r in rows)
+    return "\n".join(parts)
+
+# callback_data кнопок выбора компаний не меняются — собираем один раз
+_CMPT_CB = tuple(pack_cb("cmpt", str(i)) for i in range(len(COMPANIES)))
+_CMPDONE_CB = pack_cb("cmpdone", "1")
+_CMPALL_CB = pack_cb("cmpall", "1")
+_CMPNONE_CB = pack_cb("cmpnone", "1")
+
+
+# Клавиатура зависит только от (маска, лимит) — на каждый клик её не пересобираем
+@functools.lru_cache(maxsize=4096)
+def kb_companies_multi(selected_mask: int, max_selection: int = 5) -> InlineKeyboardMarkup:
     b = InlineKeyboardBuilder()
 
     for idx, name in enumerate(COMPANIES):
-        checked = "☑️" if idx in selected_idx else "⬜️"
-        b.add(InlineKeyboardButton(text=f"{checked} {name}", callback_data=pack_cb("cmpt", str(idx))))
+        checked = "☑️" if selected_mask >> idx & 1 else "⬜️"
+        b.add(InlineKeyboardButton(text=f"{checked} {name}", callback_data=_CMPT_CB[idx]))
 
-    b.add(InlineKeyboardButton(text="✅ Готово", callback_data=pack_cb("cmpdone", "1")))
+    b.add(InlineKeyboardButton(text="✅ Готово", callback_data=_CMPDONE_CB))
     b.add(
-        InlineKeyboardButton(text="Выбрать все", callback_data=pack_cb("cmpall", "1")),
-        InlineKeyboardButton(text="Снять все", callback_data=pack_cb("cmpnone", "1")),
+        InlineKeyboardButton(text="Выбрать все", callback_data=_CMPALL_CB),
+        InlineKeyboardButton(text="Снять все", callback_data=_CMPNONE_CB),
     )
 
-    if selected_idx:
-        selection_info = f"Выбрано: {len(selected_idx)}/{max_selection}"
+    if selected_mask:
+        selection_info = f"Выбрано: {selected_mask.bit_count()}/{max_selection}"
     else:
         selection_info = f"Выберите компании (макс. {max_selection})"
 
@@ -125,7 +178,81 @@ def kb_companies_multi(selected_idx: Set[int], max_selection: int = 5) -> Inline
     return b.as_markup()
 
 
-async def safe_append_journal(
+# Сильные ссылки на фоновые задачи: иначе GC может собрать их до завершения
+_background_tasks: Set[asyncio.Task] = set()
+
+
+def _on_background_done(task: asyncio.Task) -> None:
+    _background_tasks.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        e = task.exception()
+        log.warning("Background task failed: %s: %s", type(e).__name__, e)
+
+
+def _spawn(coro) -> asyncio.Task:
+    """Запускает побочный эффект (журнал, уведомления) без ожидания в хендлере."""
+    task = asyncio.create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_on_background_done)
+    return task
+
+
+async def stop_background_tasks(timeout: float = 30.0) -> None:
+    """Ждёт фоновые задачи (уведомления, очистку) не дольше timeout, остальные отменяет."""
+    if not _background_tasks:
+        return
+    _, pending = await asyncio.wait(set(_background_tasks), timeout=timeout)
+    if pending:
+        log.warning("Background tasks timed out, %s cancelled", len(pending))
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+
+
+# -------------------------
+# Журнал: очередь + один воркер, пачки пишутся за один цикл WebDAV
+# -------------------------
+JOURNAL_BATCH_MAX = 50
+# После первой строки ждём до стольких секунд хвост всплеска (одобрил → выдал → вернул)
+JOURNAL_FLUSH_DELAY = 0.5
+_journal_queue: Optional[asyncio.Queue] = None
+_journal_worker_task: Optional[asyncio.Task] = None
+
+
+async def _journal_worker(settings, queue: asyncio.Queue) -> None:
+    loop = asyncio.get_running_loop()
+    while True:
+        batch = [await queue.get()]
+        deadline = loop.time() + JOURNAL_FLUSH_DELAY
+        while len(batch) < JOURNAL_BATCH_MAX:
+            try:
+                batch.append(queue.get_nowait())
+                continue
+            except asyncio.QueueEmpty:
+                pass
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        try:
+            await append_journal_rows(
+                webdav_url=settings.nc_webdav_url,
+                nc_user=settings.nc_user,
+                nc_app_password=settings.nc_app_password,
+                journal_path=settings.journal_path,
+                entries=batch,
+            )
+        except Exception as e:
+            log.warning("Journal append failed: %s: %s", type(e).__name__, e)
+        finally:
+            for _ in batch:
+                queue.task_done()
+
+
+def safe_append_journal(
         *,
         settings,
         request_row: Any,
@@ -134,80 +261,114 @@ async def safe_append_journal(
         request_items: Optional[List[Dict[str, Any]]] = None,
 ) -> None:
     """
-    Пишет строку в XLSX-журнал в Nextcloud WebDAV.
-    Ничего не валит: ошибки только в лог.
+    Ставит строку XLSX-журнала (Nextcloud WebDAV) в очередь фонового воркера.
+    Ничего не валит и не ждёт сети: ошибки только в лог.
     """
+    global _journal_queue, _journal_worker_task
+    if not settings.journal_enabled:
+        return
     try:
-        if not settings.nc_webdav_url or not settings.nc_user or not settings.nc_app_password or not settings.journal_path:
-            return
-
-        await append_journal_row(
-            webdav_url=settings.nc_webdav_url,
-            nc_user=settings.nc_user,
-            nc_app_password=settings.nc_app_password,
-            journal_path=settings.journal_path,
-            request_row=request_row,
-            action=action,
-            actor_tg_id=actor_tg_id,
-            request_items=request_items,
-        )
+        if _journal_queue is None:
+            _journal_queue = asyncio.Queue()
+            _journal_worker_task = asyncio.create_task(_journal_worker(settings, _journal_queue))
+        _journal_queue.put_nowait(JournalEntry(request_row, action, actor_tg_id, request_items))
     except Exception as e:
         log.warning("Journal append failed: %s: %s", type(e).__name__, e)
 
 
+async def stop_journal_worker(timeout: float = 30.0) -> None:
+    """Дописывает накопленное (не дольше timeout) и останавливает воркер."""
+    global _journal_queue, _journal_worker_task
+    if _journal_queue is None or _journal_worker_task is None:
+        return
+    try:
+        await asyncio.wait_for(_journal_queue.join(), timeout)
+    except asyncio.TimeoutError:
+        log.warning("Journal flush timed out, %s rows dropped", _journal_queue.qsize())
+    _journal_worker_task.cancel()
+    _journal_queue = None
+    _journal_worker_task = None
+
+
+_TOKEN_STATUS_HUMAN: Dict[str, str] = {
+    "available": "✅ свободен",
+    "reserved": "🟡 занят (ожидает выдачи)",
+    "issued": "📦 выдан",
+}
+_TOKEN_STATUS_LINE = "• <b>{}</b> — <code>{}</code> — {}".format
+_WAITLIST_LINE = "{}. {} — <code>{}</code>".format
+# Пары (компания, токен) фиксированы конфигом
+_COMPANY_TOKENS = tuple((c, COMPANY_TOKEN_MAP.get(c, "-")) for c in COMPANIES)
+
+
+def _token_status_human(token_status: str) -> str:
+    return _TOKEN_STATUS_HUMAN.get(token_status) or f"❓ {token_status}"
+
+
 def _build_tokens_status_text(tokens: List[Dict[str, Any]], user_waitlist: List[Dict[str, Any]]) -> str:
     status_by_token = {str(t.get("token_id")): str(t.get("status", "unknown")) for t in tokens}
     lines = ["🔑 <b>Статусы токенов по компаниям</b>", ""]
-
-    for company in COMPANIES:
-        token_id = COMPANY_TOKEN_MAP.get(company, "-")
-        token_status = status_by_token.get(token_id, "unknown")
-        status_human = {
-            "available": "✅ свободен",
-            "reserved": "🟡 занят (ожидает выдачи)",
-            "issued": "📦 выдан",
-        }.get(token_status, f"❓ {token_status}")
-        lines.append(f"• <b>{company}</b> — <code>{token_id}</code> — {status_human}")
+    lines.extend(
+        _TOKEN_STATUS_LINE(company, token_id, _token_status_human(status_by_token.get(token_id, "unknown")))
+        for company, token_id in _COMPANY_TOKENS
+    )
 
     if user_waitlist:
-        lines.extend(["", "⏳ <b>Вы в очереди:</b>"])
-        for idx, row in enumerate(user_waitlist, start=1):
-            company = row.get("company") or "(компания не указана)"
-            token_id = row.get("token_id") or "-"
-            lines.append(f"{idx}. {company} — <code>{token_id}</code>")
+        lines.extend(("", "⏳ <b>Вы в очереди:</b>"))
+        lines.extend(
+            _WAITLIST_LINE(idx, row.get("company") or "(компания не указана)", row.get("token_id") or "-")
+            for idx, row in enumerate(user_waitlist, start=1)
+        )
 
     return "\n".join(lines)
 
 
 async def notify_waiters_for_tokens(bot, db: Database, token_ids: List[str]) -> None:
     rows = await db.pop_waiters_for_available_tokens(token_ids)
-    for row in rows:
+
+    async def _notify(row: Dict[str, Any]) -> None:
         try:
-            await bot.send_message(
-                int(row["tg_id"]),
-                "🔔 <b>Токен освободился</b>\n\n"
-                f"Компания: <b>{row.get('company') or '-'}</b>\n"
-                f"Токен: <code>{row.get('token_id') or '-'}</code>\n\n"
-                "Теперь вы можете создать новую заявку.",
-            )
+            async with TG_SEND_LIMITER:
+                await bot.send_message(
+                    int(row["tg_id"]),
+                    "🔔 <b>Токен освободился</b>\n\n"
+                    f"Компания: <b>{row.get('company') or '-'}</b>\n"
+                    f"Токен: <code>{row.get('token_id') or '-'}</code>\n\n"
+                    "Теперь вы можете создать новую заявку.",
+                )
         except Exception as e:
             log.warning("Failed to notify waitlist user %s: %s", row.get("tg_id"), e)
 
+    await asyncio.gather(*(_notify(row) for row in rows))
+
+
+async def _edit_callback_message(callback: CallbackQuery, text: str) -> None:
+    # callback.message читается уже внутри корутины: недоступное сообщение — ошибка gather, а не хендлера
+    await callback.message.edit_text(text)
+
+
+async def _send_concurrently(sends: Dict[str, Awaitable[Any]]) -> None:
+    """Независимые отправки/правки — параллельно; ошибки только логируются."""
+    async def _limited(aw: Awaitable[Any]) -> Any:
+        async with TG_SEND_LIMITER:
+            return await aw
+
+    results = await asyncio.gather(*(_limited(aw) for aw in sends.values()), return_exceptions=True)
+    for what, res in zip(sends, results):
+        if isinstance(res, Exception):
+            log.warning("Failed to %s: %s: %s", what, type(res).__name__, res)
+
 
 # -------------------------
 # Commands
 # -------------------------
 @router.message(CommandStart())
 async def cmd_start(message: Message, db: Database) -> None:
-    welcome_text = (
-        "👋 <b>Приветствуем в системе учёта USB-носителей с ЭЦП!</b>\n\n"
-        "Я помогу вам управлять заявками на выдачу токенов для подписи документов.\n\n"
-        "Для начала работы используйте кнопки меню ниже."
+    # Приветствие и справка — одним сообщением; ФИО читаем параллельно с отправкой
+    _, full_name = await asyncio.gather(
+        message.answer(START_TEXT, reply_markup=MAIN_MENU_KB),
+        db.get_user_full_name(message.from_user.id),
     )
-    await message.answer(welcome_text, reply_markup=main_menu_kb())
-    await message.answer(help_text(), reply_markup=main_menu_kb())
-
-    full_name = await db.get_user_full_name(message.from_user.id)
     if not full_name:
         await message.answer(
             "⚠️ Для работы с заявками обязательно заполните ФИО: нажмите кнопку «🪪 Профиль (ФИО)»."
@@ -216,12 +377,12 @@ async def cmd_start(message: Message, db: Database) -> None:
 
 @router.message(Command("menu"))
 async def cmd_menu(message: Message) -> None:
-    await message.answer("📱 <b>Главное меню</b> 👇", reply_markup=main_menu_kb())
+    await message.answer("📱 <b>Главное меню</b> 👇", reply_markup=MAIN_MENU_KB)
 
 
 @router.message(Command("help"))
 async def cmd_help(message: Message) -> None:
-    await message.answer(help_text(), reply_markup=main_menu_kb())
+    await message.answer(HELP_TEXT, reply_markup=MAIN_MENU_KB)
 
 
 async def _ask_full_name(message: Message, state: FSMContext, *, next_step: str) -> None:
@@ -244,11 +405,11 @@ async def cmd_profile(message: Message, state: FSMContext) -> None:
 async def cmd_cancel(message: Message, state: FSMContext) -> None:
     current_state = await state.get_state()
     if current_state is None:
-        await message.answer("Нечего отменять.", reply_markup=main_menu_kb())
+        await message.answer("Нечего отменять.", reply_markup=MAIN_MENU_KB)
         return
 
     await state.clear()
-    await message.answer("❌ Действие отменено.", reply_markup=main_menu_kb())
+    await message.answer("❌ Действие отменено.", reply_markup=MAIN_MENU_KB)
 
 @router.message(Command("request"))
 async def cmd_request_alias(message: Message, state: FSMContext, settings, db: Database) -> None:
@@ -276,9 +437,11 @@ async def cmd_active_alias(message: Message, db: Database, settings) -> None:
 
 @router.message(Command("tokens"))
 async def cmd_tokens(message: Message, db: Database) -> None:
-    tokens = await db.list_all_tokens()
-    user_waitlist = await db.list_user_waitlist(message.from_user.id, limit=20)
-    await message.answer(_build_tokens_status_text(tokens, user_waitlist), reply_markup=main_menu_kb())
+    tokens, user_waitlist = await asyncio.gather(
+        db.list_all_tokens(),
+        db.list_user_waitlist(message.from_user.id, limit=20),
+    )
+    await message.answer(_build_tokens_status_text(tokens, user_waitlist), reply_markup=MAIN_MENU_KB)
 
 # -------------------------
 # Menu buttons
@@ -333,31 +496,28 @@ async def cmd_my(message: Message, db: Database) -> None:
             await message.answer(
                 "📭 <b>У вас пока нет заявок.</b>\n\n"
                 "Нажмите «✅ Создать заявку» для оформления новой.",
-                reply_markup=main_menu_kb()
+                reply_markup=MAIN_MENU_KB
             )
             return
 
-        lines = ["📋 <b>Ваши заявки:</b>\n"]
-        for r in rows:
-            items = await db.get_request_items(r.id)
-            lines.append(request_card_text(r, items))
-            lines.append("—" * 20)
-
-        await message.answer("\n".join(lines), reply_markup=main_menu_kb())
+        items_map = await db.get_request_items_bulk([r.id for r in rows])
+        await message.answer(_cards_text("📋 <b>Ваши заявки:</b>\n", rows, items_map), reply_markup=MAIN_MENU_KB)
     except Exception as e:
         log.error("Error in cmd_my: %s", e)
-        await message.answer("Ошибка при загрузке заявок.", reply_markup=main_menu_kb())
+        await message.answer("Ошибка при загрузке заявок.", reply_markup=MAIN_MENU_KB)
 
 
-async def _start_request_companies_step(message: Message, state: FSMContext, settings) -> None:
+async def _start_request_companies_step(message: Message, state: FSMContext, settings, full_name: str) -> None:
     await state.set_state(RequestFSM.companies)
-    await state.update_data(selected_companies=[])
+    # выбор компаний хранится битовой маской: бит i — COMPANIES[i];
+    # ФИО уже известно — держим в FSM, чтобы не перечитывать при создании заявки
+    await state.update_data(selected_mask=0, full_name=full_name)
     max_companies = getattr(settings, "max_companies_per_request", 5)
 
     await message.answer(
         f"📋 <b>Создание заявки</b>\n\n"
         f"Выберите компании (можно несколько, максимум {max_companies}).",
-        reply_markup=kb_companies_multi(set(), max_companies),
+        reply_markup=kb_companies_multi(0, max_companies),
     )
 
 
@@ -375,50 +535,67 @@ async def cmd_request(message: Message, state: FSMContext, settings, db: Databas
         )
         return
 
-    await _start_request_companies_step(message, state, settings)
+    await _start_request_companies_step(message, state, settings, full_name)
+
+
+async def _answer_cards(message: Message, cards: Iterable[Tuple[int, str, InlineKeyboardMarkup]]) -> None:
+    """
+    Карточки уходят в один чат строго по очереди: порядок сообщений совпадает с
+    порядком строк, а лимит Telegram на чат не пробивается пачкой. Ошибка одной
+    карточки логируется и не прерывает остальные.
+    """
+    for request_id, text, kb in cards:
+        try:
+            async with TG_SEND_LIMITER:
+                await message.answer(text, reply_markup=kb)
+        except Exception as e:
+            log.warning("Failed to send card #%s: %s: %s", request_id, type(e).__name__, e)
 
 
 async def cmd_pending(message: Message, db: Database, settings) -> None:
     if not is_director(message.from_user.id, settings):
-        await message.answer("⛔ Доступ только для директора.", reply_markup=main_menu_kb())
+        await message.answer("⛔ Доступ только для директора.", reply_markup=MAIN_MENU_KB)
         return
 
     rows = await db.list_pending_for_director(limit=20)
     if not rows:
-        await message.answer("Нет заявок на согласовании.", reply_markup=main_menu_kb())
+        await message.answer("Нет заявок на согласовании.", reply_markup=MAIN_MENU_KB)
         return
 
     await message.answer(f"🧑‍💼 <b>На согласовании:</b> {len(rows)} заявок")
 
-    for r in rows:
-        items = await db.get_request_items(r.id)
-        await message.answer(
-            request_card_text(r, items),
-            reply_markup=kb_director_decision(r.id),
-        )
+    items_map = await db.get_request_items_bulk([r.id for r in rows])
+    await _answer_cards(
+        message,
+        ((r.id, request_card_text(r, items_map[r.id]), kb_director_decision(r.id)) for r in rows),
+    )
 
 
 async def cmd_active(message: Message, db: Database, settings) -> None:
     if not is_officer(message.from_user.id, settings):
-        await message.answer("⛔ Доступ только для уполномоченного.", reply_markup=main_menu_kb())
+        await message.answer("⛔ Доступ только для уполномоченного.", reply_markup=MAIN_MENU_KB)
         return
 
-    approved = await db.list_active_for_officer(limit=30)
-    issued = await db.list_requests_by_status("ISSUED", limit=30)
-    rows = approved + issued
+    approved, issued = await asyncio.gather(
+        db.list_active_for_officer(limit=30),
+        db.list_requests_by_status("ISSUED", limit=30),
+    )
+    total = len(approved) + len(issued)
 
-    if not rows:
-        await message.answer("Нет активных заявок.", reply_markup=main_menu_kb())
+    if not total:
+        await message.answer("Нет активных заявок.", reply_markup=MAIN_MENU_KB)
         return
 
-    await message.answer(f"🛡 <b>Активные заявки:</b> {len(rows)}")
+    await message.answer(f"🛡 <b>Активные заявки:</b> {total}")
 
-    for r in rows:
-        items = await db.get_request_items(r.id)
-        await message.answer(
-            request_card_text(r, items),
-            reply_markup=kb_officer_actions(r.id, r.status),
-        )
+    items_map = await db.get_request_items_bulk([r.id for r in itertools.chain(approved, issued)])
+    await _answer_cards(
+        message,
+        (
+            (r.id, request_card_text(r, items_map[r.id]), kb_officer_actions(r.id, r.status))
+            for r in itertools.chain(approved, issued)
+        ),
+    )
 
 
 @router.message(RequestFSM.full_name)
@@ -441,75 +618,63 @@ async def msg_full_name(message: Message, state: FSMContext, db: Database, setti
     await message.answer(f"✅ ФИО сохранено: <b>{full_name}</b>")
 
     if next_step == "request":
-        await _start_request_companies_step(message, state, settings)
+        await _start_request_companies_step(message, state, settings, full_name)
         return
 
     await state.clear()
-    await message.answer("📱 <b>Главное меню</b> 👇", reply_markup=main_menu_kb())
+    await message.answer("📱 <b>Главное меню</b> 👇", reply_markup=MAIN_MENU_KB)
 
 
 # -------------------------
 # Companies selection (callbacks)
 # -------------------------
-@router.callback_query(F.data.startswith("act:cmpt:"), RequestFSM.companies)
-async def cb_company_toggle(callback: CallbackQuery, state: FSMContext, settings) -> None:
-    try:
-        action, value = unpack_cb(callback.data)
-        if action != "cmpt":
-            return
-        idx = int(value)
-        if idx < 0 or idx >= len(COMPANIES):
-            await callback.answer("Некорректная компания", show_alert=True)
-            return
-    except Exception:
-        await callback.answer("Ошибка данных", show_alert=True)
+async def cb_company_toggle(callback: CallbackQuery, idx: int, state: FSMContext, db: Database, settings) -> None:
+    if idx < 0 or idx >= len(COMPANIES):
+        await callback.answer("Некорректная компания", show_alert=True)
         return
 
     data = await state.get_data()
-    selected: List[int] = data.get("selected_companies", [])
-    selected_set = set(int(x) for x in selected)
+    mask: int = data.get("selected_mask", 0)
+    bit = 1 << idx
 
     max_companies = getattr(settings, 'max_companies_per_request', 5)
 
-    if idx in selected_set:
-        selected_set.remove(idx)
+    if mask & bit:
+        mask ^= bit
+    elif mask.bit_count() >= max_companies:
+        await callback.answer(f"Максимум {max_companies} компаний", show_alert=True)
+        return
     else:
-        if len(selected_set) >= max_companies:
-            await callback.answer(f"Максимум {max_companies} компаний", show_alert=True)
-            return
-        selected_set.add(idx)
+        mask |= bit
 
-    await state.update_data(selected_companies=sorted(selected_set))
-    await safe_edit_text(callback, "✅ Выберите компании:", reply_markup=kb_companies_multi(selected_set, max_companies))
+    await state.update_data(selected_mask=mask)
+    await safe_edit_text(callback, "✅ Выберите компании:", reply_markup=kb_companies_multi(mask, max_companies))
     await callback.answer()
 
 
-@router.callback_query(F.data.startswith("act:cmpall:"), RequestFSM.companies)
-async def cb_company_all(callback: CallbackQuery, state: FSMContext, settings) -> None:
+async def cb_company_all(callback: CallbackQuery, value: str, state: FSMContext, db: Database, settings) -> None:
     max_companies = getattr(settings, 'max_companies_per_request', 5)
-    selected_set = set(range(min(len(COMPANIES), max_companies)))
-    await state.update_data(selected_companies=sorted(selected_set))
-    await safe_edit_text(callback, "✅ Выберите компании:", reply_markup=kb_companies_multi(selected_set, max_companies))
+    mask = (1 << min(len(COMPANIES), max_companies)) - 1
+    await state.update_data(selected_mask=mask)
+    await safe_edit_text(callback, "✅ Выберите компании:", reply_markup=kb_companies_multi(mask, max_companies))
     await callback.answer()
 
 
-@router.callback_query(F.data.startswith("act:cmpnone:"), RequestFSM.companies)
-async def cb_company_none(callback: CallbackQuery, state: FSMContext, settings) -> None:
+async def cb_company_none(callback: CallbackQuery, value: str, state: FSMContext, db: Database, settings) -> None:
     max_companies = getattr(settings, 'max_companies_per_request', 5)
-    await state.update_data(selected_companies=[])
-    await safe_edit_text(callback, "✅ Выберите компании:", reply_markup=kb_companies_multi(set(), max_companies))
+    await state.update_data(selected_mask=0)
+    await safe_edit_text(callback, "✅ Выберите компании:", reply_markup=kb_companies_multi(0, max_companies))
     await callback.answer()
 
 
-@router.callback_query(F.data.startswith("act:cmpdone:"), RequestFSM.companies)
-async def cb_company_done(callback: CallbackQuery, state: FSMContext) -> None:
+async def cb_company_done(callback: CallbackQuery, value: str, state: FSMContext, db: Database, settings) -> None:
     data = await state.get_data()
-    selected: List[int] = data.get("selected_companies", [])
-    if not selected:
+    mask: int = data.get("selected_mask", 0)
+    if not mask:
         await callback.answer("Сначала выберите хотя бы одну компанию", show_alert=True)
         return
 
-    companies = [COMPANIES[i] for i in selected]
+    companies = [name for i, name in enumerate(COMPANIES) if mask >> i & 1]
     await state.update_data(companies=companies)
     await state.set_state(RequestFSM.purpose)
 
@@ -541,7 +706,7 @@ async def msg_purpose(message: Message, state: FSMContext, db: Database, setting
 
     if not companies:
         await state.clear()
-        await message.answer("Ошибка состояния. Начните заново.", reply_markup=main_menu_kb())
+        await message.answer("Ошибка состояния. Начните заново.", reply_markup=MAIN_MENU_KB)
         return
 
     missing_companies = [c for c in companies if c not in COMPANY_TOKEN_MAP]
@@ -550,7 +715,7 @@ async def msg_purpose(message: Message, state: FSMContext, db: Database, setting
         await state.clear()
         await message.answer(
             "Ошибка конфигурации: для части компаний не настроены токены. Сообщите администратору.",
-            reply_markup=main_menu_kb(),
+            reply_markup=MAIN_MENU_KB,
         )
         return
 
@@ -564,7 +729,8 @@ async def msg_purpose(message: Message, state: FSMContext, db: Database, setting
     try:
         request_id = await db.create_request_multi(
             tg_id=message.from_user.id,
-            username=(await db.get_user_full_name(message.from_user.id))
+            username=data.get("full_name")
+            or (await db.get_user_full_name(message.from_user.id))
             or fallback_username,
             items=items,
             purpose=purpose,
@@ -574,7 +740,7 @@ async def msg_purpose(message: Message, state: FSMContext, db: Database, setting
         err = str(e)
         if err.startswith("TOKEN_NOT_AVAILABLE:"):
             token_id = err.split(":", 1)[1].strip()
-            company = next((c for c, t in items if t == token_id), "Неизвестная компания")
+            company = TOKEN_COMPANY_MAP.get(token_id, "Неизвестная компания")
             joined = await db.join_waitlist(message.from_user.id, token_id, company)
             await state.clear()
             await message.answer(
@@ -583,25 +749,25 @@ async def msg_purpose(message: Message, state: FSMContext, db: Database, setting
                 f"Токен: <code>{token_id}</code>\n\n"
                 + ("✅ Вы добавлены в очередь и получите уведомление, когда токен освободится."
                    if joined else "ℹ️ Вы уже в очереди на этот токен. Уведомим, когда он освободится."),
-                reply_markup=main_menu_kb(),
+                reply_markup=MAIN_MENU_KB,
             )
             return
 
         log.error("create_request_multi failed: %s", e)
         await state.clear()
-        await message.answer("Ошибка создания заявки. Попробуйте ещё раз.", reply_markup=main_menu_kb())
+        await message.answer("Ошибка создания заявки. Попробуйте ещё раз.", reply_markup=MAIN_MENU_KB)
         return
     except Exception as e:
         log.error("create_request_multi failed: %s", e)
         await state.clear()
-        await message.answer("Ошибка создания заявки. Попробуйте ещё раз.", reply_markup=main_menu_kb())
+        await message.answer("Ошибка создания заявки. Попробуйте ещё раз.", reply_markup=MAIN_MENU_KB)
         return
 
     await state.clear()
     await message.answer(
         f"✅ <b>Заявка создана</b> (# {request_id}).\n"
         "Ожидайте решения директора.",
-        reply_markup=main_menu_kb()
+        reply_markup=MAIN_MENU_KB
     )
 
     # Notify director
@@ -609,12 +775,13 @@ async def msg_purpose(message: Message, state: FSMContext, db: Database, setting
         req = await db.get_request(request_id)
         if req:
             req_items = await db.get_request_items(request_id)
-            await message.bot.send_message(
-                chat_id=settings.director_tg_id,
-                text="🧑‍💼 <b>Новая заявка на согласование</b>\n\n" + request_card_text(req, req_items),
-                reply_markup=kb_director_decision(req.id),
-            )
-            await safe_append_journal(
+            async with TG_SEND_LIMITER:
+                await message.bot.send_message(
+                    chat_id=settings.director_tg_id,
+                    text="🧑‍💼 <b>Новая заявка на согласование</b>\n\n" + request_card_text(req, req_items),
+                    reply_markup=kb_director_decision(req.id),
+                )
+            safe_append_journal(
                 settings=settings,
                 request_row=req,
                 action="REQUESTED",
@@ -628,21 +795,7 @@ async def msg_purpose(message: Message, state: FSMContext, db: Database, setting
 # -------------------------
 # Director callbacks
 # -------------------------
-@router.callback_query(F.data.startswith("act:apr:"))
-async def cb_director_approve(callback: CallbackQuery, db: Database, settings) -> None:
-    if not is_director(callback.from_user.id, settings):
-        await callback.answer("Только директор может это делать.", show_alert=True)
-        return
-
-    try:
-        action, value = unpack_cb(callback.data)
-        if action != "apr":
-            return
-        request_id = int(value)
-    except Exception:
-        await callback.answer("Ошибка данных", show_alert=True)
-        return
-
+async def cb_director_approve(callback: CallbackQuery, request_id: int, state: FSMContext, db: Database, settings) -> None:
     try:
         req = await db.director_decide(request_id, director_tg_id=callback.from_user.id, approve=True)
         if not req:
@@ -663,29 +816,21 @@ async def cb_director_approve(callback: CallbackQuery, db: Database, settings) -
     items = await db.get_request_items(request_id)
 
     await callback.answer("✅ Одобрено")
-    try:
-        await callback.message.edit_text("✅ <b>Заявка одобрена</b>\n\n" + request_card_text(req, items))
-    except Exception:
-        pass
-
-    try:
-        await callback.bot.send_message(
+    card = request_card_text(req, items)
+    await _send_concurrently({
+        "edit director message": _edit_callback_message(callback, "✅ <b>Заявка одобрена</b>\n\n" + card),
+        "notify user": callback.bot.send_message(
             chat_id=req.tg_id,
-            text="🎉 <b>Ваша заявка одобрена директором!</b>\n\n" + request_card_text(req, items)
-        )
-    except Exception as e:
-        log.warning("Failed to notify user: %s: %s", type(e).__name__, e)
-
-    try:
-        await callback.bot.send_message(
+            text="🎉 <b>Ваша заявка одобрена директором!</b>\n\n" + card,
+        ),
+        "notify officer": callback.bot.send_message(
             chat_id=settings.officer_tg_id,
-            text="🟢 <b>Новая заявка на выдачу</b>\n\n" + request_card_text(req, items),
+            text="🟢 <b>Новая заявка на выдачу</b>\n\n" + card,
             reply_markup=kb_officer_actions(req.id, req.status),
-        )
-    except Exception as e:
-        log.warning("Failed to notify officer: %s: %s", type(e).__name__, e)
+        ),
+    })
 
-    await safe_append_journal(
+    safe_append_journal(
         settings=settings,
         request_row=req,
         action="APPROVED",
@@ -694,21 +839,7 @@ async def cb_director_approve(callback: CallbackQuery, db: Database, settings) -
     )
 
 
-@router.callback_query(F.data.startswith("act:rej:"))
-async def cb_director_reject(callback: CallbackQuery, db: Database, settings) -> None:
-    if not is_director(callback.from_user.id, settings):
-        await callback.answer("Только директор может это делать.", show_alert=True)
-        return
-
-    try:
-        action, value = unpack_cb(callback.data)
-        if action != "rej":
-            return
-        request_id = int(value)
-    except Exception:
-        await callback.answer("Ошибка данных", show_alert=True)
-        return
-
+async def cb_director_reject(callback: CallbackQuery, request_id: int, state: FSMContext, db: Database, settings) -> None:
     try:
         req = await db.director_decide(request_id, director_tg_id=callback.from_user.id, approve=False)
         if not req:
@@ -729,20 +860,16 @@ async def cb_director_reject(callback: CallbackQuery, db: Database, settings) ->
     items = await db.get_request_items(request_id)
 
     await callback.answer("❌ Отклонено")
-    try:
-        await callback.message.edit_text("❌ <b>Заявка отклонена</b>\n\n" + request_card_text(req, items))
-    except Exception:
-        pass
-
-    try:
-        await callback.bot.send_message(
+    card = request_card_text(req, items)
+    await _send_concurrently({
+        "edit director message": _edit_callback_message(callback, "❌ <b>Заявка отклонена</b>\n\n" + card),
+        "notify user": callback.bot.send_message(
             chat_id=req.tg_id,
-            text="😔 <b>Ваша заявка отклонена директором</b>\n\n" + request_card_text(req, items)
-        )
-    except Exception as e:
-        log.warning("Failed to notify user: %s: %s", type(e).__name__, e)
+            text="😔 <b>Ваша заявка отклонена директором</b>\n\n" + card,
+        ),
+    })
 
-    await safe_append_journal(
+    safe_append_journal(
         settings=settings,
         request_row=req,
         action="REJECTED",
@@ -750,27 +877,13 @@ async def cb_director_reject(callback: CallbackQuery, db: Database, settings) ->
         request_items=items,
     )
 
-    await notify_waiters_for_tokens(callback.bot, db, [it.get("token_id") for it in items])
+    _spawn(notify_waiters_for_tokens(callback.bot, db, [it.get("token_id") for it in items]))
 
 
 # -------------------------
 # Officer callbacks
 # -------------------------
-@router.callback_query(F.data.startswith("act:iss:"))
-async def cb_officer_issued(callback: CallbackQuery, db: Database, settings) -> None:
-    if not is_officer(callback.from_user.id, settings):
-        await callback.answer("Только уполномоченный может это делать.", show_alert=True)
-        return
-
-    try:
-        action, value = unpack_cb(callback.data)
-        if action != "iss":
-            return
-        request_id = int(value)
-    except Exception:
-        await callback.answer("Ошибка данных", show_alert=True)
-        return
-
+async def cb_officer_issued(callback: CallbackQuery, request_id: int, state: FSMContext, db: Database, settings) -> None:
     try:
         req = await db.officer_issue(request_id, officer_tg_id=callback.from_user.id)
         if not req:
@@ -791,20 +904,16 @@ async def cb_officer_issued(callback: CallbackQuery, db: Database, settings) ->
     items = await db.get_request_items(request_id)
 
     await callback.answer("📦 Выдано")
-    try:
-        await callback.message.edit_text("📦 <b>Токены выданы</b>\n\n" + request_card_text(req, items))
-    except Exception:
-        pass
-
-    try:
-        await callback.bot.send_message(
+    card = request_card_text(req, items)
+    await _send_concurrently({
+        "edit officer message": _edit_callback_message(callback, "📦 <b>Токены выданы</b>\n\n" + card),
+        "notify user": callback.bot.send_message(
             chat_id=req.tg_id,
-            text="📦 <b>Вам выдали токены</b>\n\n" + request_card_text(req, items)
-        )
-    except Exception as e:
-        log.warning("Failed to notify user: %s: %s", type(e).__name__, e)
+            text="📦 <b>Вам выдали токены</b>\n\n" + card,
+        ),
+    })
 
-    await safe_append_journal(
+    safe_append_journal(
         settings=settings,
         request_row=req,
         action="ISSUED",
@@ -813,21 +922,7 @@ async def cb_officer_issued(callback: CallbackQuery, db: Database, settings) ->
     )
 
 
-@router.callback_query(F.data.startswith("act:ret:"))
-async def cb_officer_returned(callback: CallbackQuery, db: Database, settings) -> None:
-    if not is_officer(callback.from_user.id, settings):
-        await callback.answer("Только уполномоченный может это делать.", show_alert=True)
-        return
-
-    try:
-        action, value = unpack_cb(callback.data)
-        if action != "ret":
-            return
-        request_id = int(value)
-    except Exception:
-        await callback.answer("Ошибка данных", show_alert=True)
-        return
-
+async def cb_officer_returned(callback: CallbackQuery, request_id: int, state: FSMContext, db: Database, settings) -> None:
     try:
         req = await db.officer_return(request_id, officer_tg_id=callback.from_user.id)
         if not req:
@@ -848,20 +943,16 @@ async def cb_officer_returned(callback: CallbackQuery, db: Database, settings) -
     items = await db.get_request_items(request_id)
 
     await callback.answer("✅ Принято")
-    try:
-        await callback.message.edit_text("✅ <b>Токены возвращены</b>\n\n" + request_card_text(req, items))
-    except Exception:
-        pass
-
-    try:
-        await callback.bot.send_message(
+    card = request_card_text(req, items)
+    await _send_concurrently({
+        "edit officer message": _edit_callback_message(callback, "✅ <b>Токены возвращены</b>\n\n" + card),
+        "notify user": callback.bot.send_message(
             chat_id=req.tg_id,
-            text="✅ <b>Токены приняты (возврат оформлен)</b>\n\n" + request_card_text(req, items)
-        )
-    except Exception as e:
-        log.warning("Failed to notify user: %s: %s", type(e).__name__, e)
+            text="✅ <b>Токены приняты (возврат оформлен)</b>\n\n" + card,
+        ),
+    })
 
-    await safe_append_journal(
+    safe_append_journal(
         settings=settings,
         request_row=req,
         action="RETURNED",
@@ -869,7 +960,64 @@ async def cb_officer_returned(callback: CallbackQuery, db: Database, settings) -
         request_items=items,
     )
 
-    await notify_waiters_for_tokens(callback.bot, db, [it.get("token_id") for it in items])
+    _spawn(notify_waiters_for_tokens(callback.bot, db, [it.get("token_id") for it in items]))
+
+
+# -------------------------
+# act:* callbacks dispatch
+# -------------------------
+@dataclass(frozen=True, slots=True)
+class _ActRoute:
+    handler: Callable[..., Awaitable[None]]
+    state: Optional[str] = None  # требуемое FSM-состояние
+    role: Optional[Callable[[int, Any], bool]] = None  # проверка роли по tg_id
+    denied_text: str = ""
+    coerce: Optional[Callable[[str], Any]] = None  # разбор значения (int для id/индексов)
+
+
+_DIRECTOR_ONLY = "Только директор может это делать."
+_OFFICER_ONLY = "Только уполномоченный может это делать."
+
+_ACT_HANDLERS: Dict[str, _ActRoute] = {
+    "cmpt": _ActRoute(cb_company_toggle, state=RequestFSM.companies.state, coerce=int),
+    "cmpall": _ActRoute(cb_company_all, state=RequestFSM.companies.state),
+    "cmpnone": _ActRoute(cb_company_none, state=RequestFSM.companies.state),
+    "cmpdone": _ActRoute(cb_company_done, state=RequestFSM.companies.state),
+    "apr": _ActRoute(cb_director_approve, role=is_director, denied_text=_DIRECTOR_ONLY, coerce=int),
+    "rej": _ActRoute(cb_director_reject, role=is_director, denied_text=_DIRECTOR_ONLY, coerce=int),
+    "iss": _ActRoute(cb_officer_issued, role=is_officer, denied_text=_OFFICER_ONLY, coerce=int),
+    "ret": _ActRoute(cb_officer_returned, role=is_officer, denied_text=_OFFICER_ONLY, coerce=int),
+}
+
+
+@router.callback_query(F.data.startswith(f"{CB_PREFIX}:"))
+async def cb_act(
+    callback: CallbackQuery,
+    state: FSMContext,
+    db: Database,
+    settings,
+    raw_state: Optional[str] = None,
+    cb_action: Optional[str] = None,
+    cb_value: Optional[str] = None,
+) -> None:
+    route = _ACT_HANDLERS.get(cb_action)
+    if route is None:
+        await callback.answer("Ошибка данных", show_alert=True)
+        return
+    if route.state is not None and raw_state != route.state:
+        return
+    # Роль проверяется один раз здесь, а не в каждом хендлере
+    if route.role is not None and not route.role(callback.from_user.id, settings):
+        await callback.answer(route.denied_text, show_alert=True)
+        return
+    value: Any = cb_value
+    if route.coerce is not None:
+        try:
+            value = route.coerce(cb_value)
+        except (TypeError, ValueError):
+            await callback.answer("Ошибка данных", show_alert=True)
+            return
+    await route.handler(callback, value, state, db, settings)
 
 
 # -------------------------
@@ -930,177 +1078,161 @@ async def cmd_admindel(message: Message, db: Database, settings) -> None:
     )
 
 
-@router.callback_query(F.data.startswith("adm:"))
-async def cb_admin(call: CallbackQuery, db: Database, settings) -> None:
-    uid = call.from_user.id
-    if not is_superadmin(uid, settings):
-        await call.answer("Нет доступа", show_alert=True)
-        return
+async def _adm_edit(call: CallbackQuery, text: str) -> None:
+    await safe_edit_text(call, text, reply_markup=kb_back_to_admin())
 
-    data = (call.data or "").strip()
 
-    if data == "adm:menu":
-        await safe_edit_text(call, "🛠 <b>Админ-панель</b>", reply_markup=kb_admin_menu())
-        await call.answer()
+async def _adm_cards(call: CallbackQuery, db: Database, header: str, rows: List[Any], empty_text: Optional[str]) -> None:
+    if not rows and empty_text is not None:
+        await _adm_edit(call, empty_text)
         return
+    items_map = await db.get_request_items_bulk([r.id for r in rows])
+    await _adm_edit(call, _cards_text(header, rows, items_map))
 
-    if data == "adm:stats":
-        stats = await db.get_statistics()
-        await safe_edit_text(call, format_statistics(stats), reply_markup=kb_back_to_admin())
-        await call.answer()
-        return
 
-    if data == "adm:tokens":
-        tokens = await db.list_all_tokens()
-        await safe_edit_text(call, format_token_list(tokens), reply_markup=kb_back_to_admin())
-        await call.answer()
-        return
+async def _adm_menu(call: CallbackQuery, db: Database, settings) -> None:
+    await safe_edit_text(call, "🛠 <b>Админ-панель</b>", reply_markup=kb_admin_menu())
 
-    if data == "adm:authed":
-        users = await db.list_authed_users(limit=100)
-        if not users:
-            await safe_edit_text(call, "Нет авторизованных пользователей.", reply_markup=kb_back_to_admin())
-            await call.answer()
-            return
 
-        text = ["👥 <b>Авторизованные пользователи</b>", ""]
-        for row in users:
-            text.append(
-                f"• tg_id: <code>{row['tg_id']}</code> — "
-                f"{row.get('authed_at') or 'неизвестно'}"
-            )
+async def _adm_stats(call: CallbackQuery, db: Database, settings) -> None:
+    await _adm_edit(call, format_statistics(await db.get_statistics()))
 
-        await safe_edit_text(call, "\n".join(text), reply_markup=kb_back_to_admin())
-        await call.answer()
-        return
 
-    if data == "adm:pending":
-        rows = await db.list_requests_by_status("REQUESTED", limit=20)
-        if not rows:
-            await safe_edit_text(call, "Нет заявок на согласовании.", reply_markup=kb_back_to_admin())
-            await call.answer()
-            return
+async def _adm_tokens(call: CallbackQuery, db: Database, settings) -> None:
+    await _adm_edit(call, format_token_list(await db.list_all_tokens()))
 
-        text = ["🧑‍💼 <b>На согласовании</b>\n"]
-        for r in rows:
-            items = await db.get_request_items(r.id)
-            text.append(request_card_text(r, items))
-            text.append("—" * 20)
 
-        await safe_edit_text(call, "\n".join(text), reply_markup=kb_back_to_admin())
-        await call.answer()
+async def _adm_authed(call: CallbackQuery, db: Database, settings) -> None:
+    users = await db.list_authed_users(limit=100)
+    if not users:
+        await _adm_edit(call, "Нет авторизованных пользователей.")
         return
 
-    if data == "adm:approved":
-        rows = await db.list_requests_by_status("APPROVED", limit=20)
-        if not rows:
-            await safe_edit_text(call, "Нет одобренных заявок.", reply_markup=kb_back_to_admin())
-            await call.answer()
-            return
-        text = ["✅ <b>Одобрено</b>\n"]
-        for r in rows:
-            items = await db.get_request_items(r.id)
-            text.append(request_card_text(r, items))
-            text.append("—" * 20)
-        await safe_edit_text(call, "\n".join(text), reply_markup=kb_back_to_admin())
-        await call.answer()
-        return
+    text = ["👥 <b>Авторизованные пользователи</b>", ""]
+    for row in users:
+        text.append(
+            f"• tg_id: <code>{row['tg_id']}</code> — "
+            f"{row.get('authed_at') or 'неизвестно'}"
+        )
+    await _adm_edit(call, "\n".join(text))
 
-    if data == "adm:issued":
-        rows = await db.list_requests_by_status("ISSUED", limit=20)
-        if not rows:
-            await safe_edit_text(call, "Нет выданных (на руках) заявок.", reply_markup=kb_back_to_admin())
-            await call.answer()
-            return
-        text = ["📦 <b>Выдано (на руках)</b>\n"]
-        for r in rows:
-            items = await db.get_request_items(r.id)
-            text.append(request_card_text(r, items))
-            text.append("—" * 20)
-        await safe_edit_text(call, "\n".join(text), reply_markup=kb_back_to_admin())
-        await call.answer()
-        return
 
-    if data == "adm:active":
-        rows_a = await db.list_requests_by_status("APPROVED", limit=20)
-        rows_i = await db.list_requests_by_status("ISSUED", limit=20)
-        rows = rows_a + rows_i
-        if not rows:
-            await safe_edit_text(call, "Нет активных заявок.", reply_markup=kb_back_to_admin())
-            await call.answer()
-            return
-        text = ["🟢 <b>Активные</b>\n"]
-        for r in rows:
-            items = await db.get_request_items(r.id)
-            text.append(request_card_text(r, items))
-            text.append("—" * 20)
-        await safe_edit_text(call, "\n".join(text), reply_markup=kb_back_to_admin())
-        await call.answer()
-        return
+async def _adm_pending(call: CallbackQuery, db: Database, settings) -> None:
+    rows = await db.list_request_cards(("REQUESTED",), limit=20)
+    await _adm_cards(call, db, "🧑‍💼 <b>На согласовании</b>\n", rows, "Нет заявок на согласовании.")
+
+
+async def _adm_approved(call: CallbackQuery, db: Database, settings) -> None:
+    rows = await db.list_request_cards(("APPROVED",), limit=20)
+    await _adm_cards(call, db, "✅ <b>Одобрено</b>\n", rows, "Нет одобренных заявок.")
+
+
+async def _adm_issued(call: CallbackQuery, db: Database, settings) -> None:
+    rows = await db.list_request_cards(("ISSUED",), limit=20)
+    await _adm_cards(call, db, "📦 <b>Выдано (на руках)</b>\n", rows, "Нет выданных (на руках) заявок.")
+
+
+async def _adm_active(call: CallbackQuery, db: Database, settings) -> None:
+    rows = await db.list_request_cards(("APPROVED", "ISSUED"), limit=40)
+    await _adm_cards(call, db, "🟢 <b>Активные</b>\n", rows, "Нет активных заявок.")
 
-    if data == "adm:last20":
-        rows = await db.list_last_requests(limit=20)
-        text = ["🕒 <b>Последние 20 заявок</b>\n"]
-        for r in rows:
-            items = await db.get_request_items(r.id)
-            text.append(request_card_text(r, items))
-            text.append("—" * 20)
-        await safe_edit_text(call, "\n".join(text), reply_markup=kb_back_to_admin())
-        await call.answer()
-        return
 
-    if data.startswith("adm:over:"):
+async def _adm_last20(call: CallbackQuery, db: Database, settings) -> None:
+    rows = await db.list_request_cards(limit=20)
+    await _adm_cards(call, db, "🕒 <b>Последние 20 заявок</b>\n", rows, None)
+
+
+async def _adm_over(call: CallbackQuery, db: Database, settings, arg: str) -> None:
+    try:
+        sec = int(arg)
+    except Exception:
+        sec = 1800
+    rows = await db.stale_active_requests_over_seconds(sec)
+    await _adm_cards(call, db, f"⏱ <b>Висящие активные заявки</b> (>{sec} сек)\n", rows, "Нет просроченных заявок.")
+
+
+async def _adm_delete_help(call: CallbackQuery, db: Database, settings) -> None:
+    rows = await db.list_request_cards(limit=20)
+    lines = [
+        "🗑 <b>Удаление заявки (superadmin)</b>",
+        "",
+        "Команда: <code>/admindel ID_ЗАЯВКИ</code>",
+        "",
+        "Последние ID:",
+    ]
+    if rows:
+        lines.extend([f"• #{r.id} — {r.status}" for r in rows])
+    else:
+        lines.append("(заявок пока нет)")
+    await _adm_edit(call, "\n".join(lines))
+
+
+async def _adm_cleanup(call: CallbackQuery, db: Database, settings) -> None:
+    # Долгий DELETE не держит callback: отвечаем сразу, итог — отдельным сообщением
+    async def _run(bot, chat_id: int) -> None:
         try:
-            sec = int(data.split(":")[-1])
-        except Exception:
-            sec = 1800
-        rows = await db.stale_active_requests_over_seconds(sec)
-        if not rows:
-            await safe_edit_text(call, "Нет просроченных заявок.", reply_markup=kb_back_to_admin())
-            await call.answer()
-            return
-        text = [f"⏱ <b>Висящие активные заявки</b> (>{sec} сек)\n"]
-        for r in rows:
-            items = await db.get_request_items(r.id)
-            text.append(request_card_text(r, items))
-            text.append("—" * 20)
-        await safe_edit_text(call, "\n".join(text), reply_markup=kb_back_to_admin())
-        await call.answer()
-        return
+            deleted = await db.cleanup_old_data(days=90)
+            text = f"🧹 Удалено записей: {deleted}"
+        except Exception as e:
+            log.error("cleanup_old_data failed: %s", e)
+            text = "🧹 Ошибка очистки, подробности в логе."
+        try:
+            async with TG_SEND_LIMITER:
+                await bot.send_message(chat_id, text)
+        except Exception as e:
+            log.warning("Failed to report cleanup result: %s: %s", type(e).__name__, e)
+
+    _spawn(_run(call.bot, call.from_user.id))
+    await _adm_edit(call, "🧹 Очистка запущена в фоне, результат придёт сообщением.")
 
-    if data == "adm:delete_help":
-        rows = await db.list_last_requests(limit=20)
-        lines = [
-            "🗑 <b>Удаление заявки (superadmin)</b>",
-            "",
-            "Команда: <code>/admindel ID_ЗАЯВКИ</code>",
-            "",
-            "Последние ID:",
-        ]
-        if rows:
-            lines.extend([f"• #{r.id} — {r.status}" for r in rows])
-        else:
-            lines.append("(заявок пока нет)")
-
-        await safe_edit_text(call, "\n".join(lines), reply_markup=kb_back_to_admin())
-        await call.answer()
-        return
 
-    if data == "adm:cleanup":
-        deleted = await db.cleanup_old_data(days=90)
-        await safe_edit_text(call, f"🧹 Удалено записей: {deleted}", reply_markup=kb_back_to_admin())
-        await call.answer()
+async def _adm_webdav(call: CallbackQuery, db: Database, settings) -> None:
+    if not settings.nc_webdav_url or not settings.journal_path:
+        await _adm_edit(call, "🔄 WebDAV: не настроен (журнал отключён)")
         return
+    ok, msg = await webdav_healthcheck(
+        settings.nc_webdav_url,
+        settings.nc_user,
+        settings.nc_app_password,
+        settings.journal_path
+    )
+    await _adm_edit(call, f"🔄 WebDAV: {'✅' if ok else '❌'}\n{msg}")
+
+
+_ADMIN_ROUTES: Dict[str, Callable[[CallbackQuery, Database, Any], Awaitable[None]]] = {
+    "menu": _adm_menu,
+    "stats": _adm_stats,
+    "tokens": _adm_tokens,
+    "authed": _adm_authed,
+    "pending": _adm_pending,
+    "approved": _adm_approved,
+    "issued": _adm_issued,
+    "active": _adm_active,
+    "last20": _adm_last20,
+    "delete_help": _adm_delete_help,
+    "cleanup": _adm_cleanup,
+    "webdav": _adm_webdav,
+}
+_ADMIN_PREFIX_LEN = len("adm:")
+_ADMIN_OVER_PREFIX = "over:"
 
-    if data == "adm:webdav":
-        ok, msg = await webdav_healthcheck(
-            settings.nc_webdav_url,
-            settings.nc_user,
-            settings.nc_app_password,
-            settings.journal_path
-        )
-        await safe_edit_text(call, f"🔄 WebDAV: {'✅' if ok else '❌'}\n{msg}", reply_markup=kb_back_to_admin())
-        await call.answer()
+
+@router.callback_query(F.data.startswith("adm:"))
+async def cb_admin(call: CallbackQuery, db: Database, settings) -> None:
+    uid = call.from_user.id
+    if not is_superadmin(uid, settings):
+        await call.answer("Нет доступа", show_alert=True)
         return
 
-    await call.answer("Неизвестная команда", show_alert=True)
+    # "adm:<action>[:<arg>]" — префикс уже проверен фильтром, разбираем один раз
+    action = call.data[_ADMIN_PREFIX_LEN:]
+
+    route = _ADMIN_ROUTES.get(action)
+    if route is not None:
+        await route(call, db, settings)
+    elif action.startswith(_ADMIN_OVER_PREFIX):
+        await _adm_over(call, db, settings, action[len(_ADMIN_OVER_PREFIX):])
+    else:
+        await call.answer("Неизвестная команда", show_alert=True)
+        return
+    await call.answer()
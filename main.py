@@ -4,75 +4,118 @@ from __future__ import annotations
 import asyncio
 import logging
 import time
-from typing import Any, Awaitable, Callable, Dict, Optional
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
 
 from aiogram import Bot, Dispatcher
 from aiogram.client.default import DefaultBotProperties
 from aiogram.enums import ParseMode
-from aiogram.types import BotCommand, Message, CallbackQuery
+from aiogram.types import BotCommand, CallbackQuery, Message, Update
 from aiogram.dispatcher.middlewares.base import BaseMiddleware
 
-from config import load_settings
+from config import STATUS_REQUESTED, load_settings
 from db import Database
-from handlers import router
-from utils import is_director, is_officer, is_superadmin
+from handlers import router, stop_background_tasks, stop_journal_worker
+from utils import TG_SEND_LIMITER, close_webdav_session, is_director, is_officer, is_superadmin
 
 log = logging.getLogger("main")
 
 
+def _message_uid_text(event: Message) -> Tuple[Optional[int], str]:
+    return (event.from_user.id if event.from_user else None), (event.text or "")[:200]
+
+
+def _callback_uid_text(event: CallbackQuery) -> Tuple[Optional[int], str]:
+    return (event.from_user.id if event.from_user else None), (event.data or "")[:200]
+
+
+# Диспетчеризация по точному типу события: один dict-lookup вместо цепочки isinstance
+_EVENT_EXTRACT: Dict[type, Callable[[Any], Tuple[Optional[int], str]]] = {
+    Message: _message_uid_text,
+    CallbackQuery: _callback_uid_text,
+}
+
+
+def _unwrap(event: Any) -> Any:
+    # Мидлвари висят на dp.update: приходит Update, полезная нагрузка — в update.event
+    return event.event if type(event) is Update else event
+
+
+def _event_uid_text(event: Any) -> Tuple[Optional[int], str]:
+    inner = _unwrap(event)
+    extract = _EVENT_EXTRACT.get(type(inner))
+    return extract(inner) if extract else (None, "")
+
+
 class PinAuthMiddleware(BaseMiddleware):
     """
-    Если включён BOT_PIN, то:
+    Регистрируется только при заданном BOT_PIN. Тогда:
       - директор/уполномоченный/superadmin проходят без PIN
       - остальные обязаны один раз выполнить /pin <код>
+
+    Положительное решение кэшируется по uid на ALLOWED_TTL секунд: роли берутся
+    из настроек процесса, а авторизация по PIN снимается только revoke_auth.
+    Отказы не кэшируются — после /pin пользователь проходит сразу.
     """
 
+    ALLOWED_TTL = 300.0
+    ALLOWED_MAXSIZE = 10_000
+
+    def __init__(self) -> None:
+        self._allowed: Dict[int, float] = {}
+
+    def _remember(self, uid: int) -> None:
+        if len(self._allowed) >= self.ALLOWED_MAXSIZE:
+            self._allowed.clear()
+        self._allowed[uid] = time.monotonic() + self.ALLOWED_TTL
+
     async def __call__(
         self,
         handler: Callable[[Any, Dict[str, Any]], Awaitable[Any]],
         event: Any,
         data: Dict[str, Any],
     ) -> Any:
-        settings = data.get("settings")
-        db: Database = data.get("db")
-        if not settings or not getattr(settings, "bot_pin", None):
-            return await handler(event, data)
+        settings = data["settings"]
+        db: Database = data["db"]
 
-        uid: Optional[int] = None
-        if isinstance(event, Message) and event.from_user:
-            uid = event.from_user.id
-        elif isinstance(event, CallbackQuery) and event.from_user:
-            uid = event.from_user.id
+        inner = _unwrap(event)
+        kind = type(inner)
+        extract = _EVENT_EXTRACT.get(kind)
+        if extract is None:
+            return await handler(event, data)
+        uid, text = extract(inner)
 
         if uid is None:
             return await handler(event, data)
 
+        expires = self._allowed.get(uid)
+        if expires is not None and expires > time.monotonic():
+            return await handler(event, data)
+
         # exemptions
         if is_superadmin(uid, settings) or is_director(uid, settings) or is_officer(uid, settings):
+            self._remember(uid)
             return await handler(event, data)
 
         if await db.is_authed(uid):
+            self._remember(uid)
             return await handler(event, data)
 
         # not authed
-        if isinstance(event, Message):
-            text = (event.text or "").strip()
-            if text.startswith("/pin"):
+        if kind is Message:
+            if text.strip().startswith("/pin"):
                 return await handler(event, data)
 
-            await event.answer(
+            await inner.answer(
                 "🔐 Доступ к боту защищён PIN-кодом.\n\n"
                 "Введи PIN одной командой:\n"
                 "/pin 1234"
             )
             return
 
-        if isinstance(event, CallbackQuery):
-            try:
-                await event.answer("🔐 Введите PIN: /pin 1234", show_alert=True)
-            except Exception:
-                pass
-            return
+        try:
+            await inner.answer("🔐 Введите PIN: /pin 1234", show_alert=True)
+        except Exception:
+            pass
 
 
 class UpdateLoggingMiddleware(BaseMiddleware):
@@ -84,28 +127,26 @@ class UpdateLoggingMiddleware(BaseMiddleware):
         event: Any,
         data: Dict[str, Any],
     ) -> Any:
-        uid: Optional[int] = None
-        etype = type(event).__name__
-        text = ""
-
-        if isinstance(event, Message) and event.from_user:
-            uid = event.from_user.id
-            text = (event.text or "")[:200]
-        elif isinstance(event, CallbackQuery) and event.from_user:
-            uid = event.from_user.id
-            text = (event.data or "")[:200]
-
         start = time.perf_counter()
         try:
             result = await handler(event, data)
-            took_ms = (time.perf_counter() - start) * 1000
-            log.info("update ok type=%s uid=%s payload=%r took_ms=%.1f", etype, uid, text, took_ms)
-            return result
         except Exception:
             took_ms = (time.perf_counter() - start) * 1000
-            log.exception("update failed type=%s uid=%s payload=%r took_ms=%.1f", etype, uid, text, took_ms)
+            uid, text = _event_uid_text(event)
+            log.exception(
+                "update failed type=%s uid=%s payload=%r took_ms=%.1f", type(_unwrap(event)).__name__, uid, text, took_ms
+            )
             raise
 
+        # Успешные апдейты — DEBUG: без него не тратимся на извлечение/форматирование payload
+        if log.isEnabledFor(logging.DEBUG):
+            took_ms = (time.perf_counter() - start) * 1000
+            uid, text = _event_uid_text(event)
+            log.debug(
+                "update ok type=%s uid=%s payload=%r took_ms=%.1f", type(_unwrap(event)).__name__, uid, text, took_ms
+            )
+        return result
+
 
 async def director_reminder_loop(bot: Bot, db: Database, settings) -> None:
     """
@@ -118,13 +159,24 @@ async def director_reminder_loop(bot: Bot, db: Database, settings) -> None:
         settings.remind_check_seconds,
     )
 
+    # Эпоха БД, на которой заявок REQUESTED не было вовсе: пока requests не менялась,
+    # напоминать гарантированно не о чем и опрос можно пропускать
+    idle_epoch: Optional[int] = None
+
     while True:
         try:
+            epoch = db.requests_epoch
+            if epoch == idle_epoch:
+                await asyncio.sleep(max(10, int(settings.remind_check_seconds)))
+                continue
+
             rows = await db.pending_for_remind(
                 after_minutes=settings.remind_after_minutes,
                 repeat_minutes=settings.remind_repeat_minutes,
             )
             log.info("Reminder check: found %s pending requests", len(rows))
+            if not rows and not (await db.counts_by_status()).get(STATUS_REQUESTED):
+                idle_epoch = epoch
             if rows:
                 lines = [
                     "⏰ Напоминание: есть заявки на согласовании.",
@@ -138,7 +190,8 @@ async def director_reminder_loop(bot: Bot, db: Database, settings) -> None:
 
                 lines.append("\nОткройте: /pending (или меню → «Директор: На согласовании»).")
 
-                await bot.send_message(settings.director_tg_id, "\n".join(lines))
+                async with TG_SEND_LIMITER:
+                    await bot.send_message(settings.director_tg_id, "\n".join(lines))
                 await db.mark_reminded([r.id for r in rows])
 
         except asyncio.CancelledError:
@@ -149,43 +202,71 @@ async def director_reminder_loop(bot: Bot, db: Database, settings) -> None:
         await asyncio.sleep(max(10, int(settings.remind_check_seconds)))
 
 
+# Команды (шорткаты): набор статичный, /pin — только при включённом BOT_PIN
+_BASE_COMMANDS = (
+    BotCommand(command="menu", description="Показать меню"),
+    BotCommand(command="help", description="Справка"),
+    BotCommand(command="profile", description="Профиль / ФИО"),
+    BotCommand(command="cancel", description="Отмена"),
+    BotCommand(command="request", description="Создать заявку"),
+    BotCommand(command="my", description="Мои заявки"),
+    BotCommand(command="tokens", description="Статусы токенов"),
+    BotCommand(command="pending", description="Директор: согласование"),
+    BotCommand(command="active", description="Уполномоченный: активные"),
+)
+_ADMIN_COMMANDS = (
+    BotCommand(command="admin", description="Админ-панель (superadmin)"),
+    BotCommand(command="admindel", description="Удалить заявку по ID (superadmin)"),
+)
+_DEFAULT_COMMANDS = [*_BASE_COMMANDS, *_ADMIN_COMMANDS]
+_PIN_COMMANDS = [*_BASE_COMMANDS, BotCommand(command="pin", description="Ввести PIN-код"), *_ADMIN_COMMANDS]
+
+
 async def startup(bot: Bot, db: Database, settings) -> None:
     await db.init()
     log.info("Database initialized")
 
-    # Команды (шорткаты)
-    cmds = [
-        BotCommand(command="menu", description="Показать меню"),
-        BotCommand(command="help", description="Справка"),
-        BotCommand(command="profile", description="Профиль / ФИО"),
-        BotCommand(command="cancel", description="Отмена"),
-        BotCommand(command="request", description="Создать заявку"),
-        BotCommand(command="my", description="Мои заявки"),
-        BotCommand(command="tokens", description="Статусы токенов"),
-        BotCommand(command="pending", description="Директор: согласование"),
-        BotCommand(command="active", description="Уполномоченный: активные"),
-    ]
-    if getattr(settings, "bot_pin", None):
-        cmds.append(BotCommand(command="pin", description="Ввести PIN-код"))
-    cmds.append(BotCommand(command="admin", description="Админ-панель (superadmin)"))
-    cmds.append(BotCommand(command="admindel", description="Удалить заявку по ID (superadmin)"))
-
     try:
-        await bot.set_my_commands(cmds)
+        await bot.set_my_commands(_PIN_COMMANDS if settings.bot_pin else _DEFAULT_COMMANDS)
         log.info("Telegram command menu configured")
     except Exception as e:
         log.warning("Failed to set bot commands: %s", e)
 
+    # Журнал необязателен, но выключаться молча не должен: опечатка в NC_* иначе незаметна
+    if not settings.journal_enabled:
+        journal_env = {
+            "NC_WEBDAV_URL": settings.nc_webdav_url,
+            "NC_USER": settings.nc_user,
+            "NC_APP_PASSWORD": settings.nc_app_password,
+            "JOURNAL_PATH": settings.journal_path,
+        }
+        missing = [name for name, value in journal_env.items() if not value]
+        if len(missing) < len(journal_env):
+            log.warning("WebDAV journal disabled: missing %s", ", ".join(missing))
+        else:
+            log.warning("WebDAV journal disabled: %s not set", "/".join(journal_env))
+
     # Запуск напоминаний, только если включены
-    if (
-        getattr(settings, "director_tg_id", None)
-        and int(getattr(settings, "remind_check_seconds", 0)) > 0
-        and int(getattr(settings, "remind_after_minutes", 0)) > 0
-        and int(getattr(settings, "remind_repeat_minutes", 0)) > 0
-    ):
+    if settings.reminders_enabled:
         asyncio.create_task(director_reminder_loop(bot, db, settings))
     else:
-        log.info("Director reminders disabled: director_tg_id=%r remind_check_seconds=%r remind_after_minutes=%r remind_repeat_minutes=%r", getattr(settings, "director_tg_id", None), getattr(settings, "remind_check_seconds", None), getattr(settings, "remind_after_minutes", None), getattr(settings, "remind_repeat_minutes", None))
+        log.info(
+            "Director reminders disabled: director_tg_id=%r remind_check_seconds=%r "
+            "remind_after_minutes=%r remind_repeat_minutes=%r",
+            settings.director_tg_id,
+            settings.remind_check_seconds,
+            settings.remind_after_minutes,
+            settings.remind_repeat_minutes,
+        )
+
+
+async def shutdown(db: Database) -> None:
+    # Сначала фоновые задачи: они пишут в БД и могут ставить строки в журнал
+    await stop_background_tasks()
+    await stop_journal_worker()
+    await close_webdav_session()
+    await db.close()
+    log.info("Database closed")
 
 
 async def main() -> None:
@@ -205,10 +286,13 @@ async def main() -> None:
     db = Database(settings.db_path)
 
     dp.update.middleware(UpdateLoggingMiddleware())
-    dp.update.middleware(PinAuthMiddleware())
+    # Без BOT_PIN мидлварь не регистрируем вовсе — ноль накладных расходов на апдейт
+    if settings.bot_pin:
+        dp.update.middleware(PinAuthMiddleware())
     dp.include_router(router)
 
     dp.startup.register(startup)
+    dp.shutdown.register(shutdown)
 
     log.info("Bot started")
     await dp.start_polling(bot, db=db, settings=settings)
@@ -0,0 +1,95 @@
+# tests/test_db.py
+import asyncio
+import os
+import sqlite3
+import tempfile
+import unittest
+
+from db import SCHEMA_VERSION, Database
+
+
+# Таблица requests до появления remind_sent_at (ещё без миграции _ensure_column)
+_LEGACY_REQUESTS_DDL = """
+CREATE TABLE requests(
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  tg_id INTEGER NOT NULL,
+  username TEXT,
+  company TEXT NOT NULL,
+  token_id TEXT NOT NULL,
+  purpose TEXT NOT NULL,
+  comment TEXT,
+  status TEXT DEFAULT 'REQUESTED',
+  requested_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+  approved_by INTEGER,
+  approved_at DATETIME,
+  issued_by INTEGER,
+  issued_at DATETIME,
+  returned_by INTEGER,
+  returned_at DATETIME
+);
+INSERT INTO requests(tg_id, username, company, token_id, purpose)
+VALUES (10, 'old', 'ООО Поле', 'KEY-02', 'legacy');
+"""
+
+
+class InitMigrationTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self._tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self._tmp.name, "bot.db")
+
+    def tearDown(self) -> None:
+        self._tmp.cleanup()
+
+    def _init(self) -> None:
+        async def run() -> None:
+            db = Database(self.path)
+            try:
+                await db.init()
+            finally:
+                await db.close()
+
+        asyncio.run(run())
+
+    def _inspect(self):
+        with sqlite3.connect(self.path) as conn:
+            cols = {r[1] for r in conn.execute("PRAGMA table_info(requests);")}
+            indexes = {r[1] for r in conn.execute("PRAGMA index_list(requests);")}
+            (version,) = conn.execute("PRAGMA user_version;").fetchone()
+            rows = conn.execute("SELECT purpose FROM requests;").fetchall()
+        return cols, indexes, version, rows
+
+    def test_init_upgrades_table_without_remind_sent_at(self) -> None:
+        with sqlite3.connect(self.path) as conn:
+            conn.executescript(_LEGACY_REQUESTS_DDL)
+
+        self._init()
+
+        cols, indexes, version, rows = self._inspect()
+        self.assertIn("remind_sent_at", cols)
+        self.assertIn("idx_requests_pending_remind", indexes)
+        self.assertEqual(version, SCHEMA_VERSION)
+        self.assertEqual(rows, [("legacy",)])
+
+    def test_init_adds_remind_index_to_db_stamped_before_v4(self) -> None:
+        self._init()
+        with sqlite3.connect(self.path) as conn:
+            conn.execute("DROP INDEX idx_requests_pending_remind;")
+            conn.execute("PRAGMA user_version=3;")
+
+        self._init()
+
+        _, indexes, version, _ = self._inspect()
+        self.assertIn("idx_requests_pending_remind", indexes)
+        self.assertEqual(version, SCHEMA_VERSION)
+
+    def test_init_is_idempotent(self) -> None:
+        self._init()
+        self._init()
+
+        _, indexes, version, _ = self._inspect()
+        self.assertIn("idx_requests_pending_remind", indexes)
+        self.assertEqual(version, SCHEMA_VERSION)
+
+
+if __name__ == "__main__":
+    unittest.main()
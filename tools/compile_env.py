@@ -0,0 +1,48 @@
+# tools/compile_env.py
+"""
+Компилирует .env в модуль env_compiled.py рядом с config.py.
+
+При старте config.py импортирует env_compiled (берётся готовый .pyc из
+__pycache__) вместо разбора .env через python-dotenv. Если модуля нет —
+работает как раньше через load_dotenv.
+
+Запуск (после каждого изменения .env):
+    python3 tools/compile_env.py [путь/к/.env]
+"""
+from __future__ import annotations
+
+import sys
+from pathlib import Path
+
+from dotenv import dotenv_values
+
+ROOT = Path(__file__).resolve().parent.parent
+OUT_PATH = ROOT / "env_compiled.py"
+
+
+def main() -> int:
+    env_path = Path(sys.argv[1]) if len(sys.argv) > 1 else ROOT / ".env"
+    if not env_path.is_file():
+        print(f"Файл не найден: {env_path}", file=sys.stderr)
+        return 1
+
+    values = dotenv_values(env_path)
+
+    lines = [
+        f"# Сгенерировано tools/compile_env.py из {env_path.name} — не редактировать вручную.",
+        "import os",
+        "",
+    ]
+    for name, value in values.items():
+        if value is None:
+            continue
+        # setdefault = то же поведение, что load_dotenv(override=False)
+        lines.append(f"os.environ.setdefault({name!r}, {value!r})")
+
+    OUT_PATH.write_text("\n".join(lines) + "\n", encoding="utf-8")
+    print(f"Записано {OUT_PATH} ({len(lines) - 3} переменных)")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
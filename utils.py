@@ -1,20 +1,23 @@
 from __future__ import annotations
 
 import asyncio
+import csv
+import functools
 import io
 import json
 import logging
-from dataclasses import asdict
+from collections import defaultdict, deque
+from dataclasses import dataclass, field, fields
 from datetime import datetime
 from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import quote
 from zoneinfo import ZoneInfo
 
+import aiohttp
 from aiogram.exceptions import TelegramBadRequest
 from aiogram.types import CallbackQuery, InlineKeyboardButton, InlineKeyboardMarkup
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 from openpyxl import Workbook, load_workbook
-from openpyxl.worksheet.worksheet import Worksheet
-from webdav3.client import Client
 
 from config import (
     COMPANIES,
@@ -38,16 +41,59 @@ def pack_cb(action: str, value: str) -> str:
     return f"{CB_PREFIX}:{action}:{value}"
 
 
+_CB_HEAD = CB_PREFIX + ":"
+_CB_HEAD_LEN = len(_CB_HEAD)
+
+
 def unpack_cb(data: str) -> Tuple[str, str]:
-    parts = (data or "").split(":", 2)
-    if len(parts) != 3 or parts[0] != CB_PREFIX:
+    # Вызывается на каждый callback: проверка префикса и один find вместо split в список
+    if not data or not data.startswith(_CB_HEAD):
         raise ValueError("Bad callback data")
-    return parts[1], parts[2]
+    sep = data.find(":", _CB_HEAD_LEN)
+    if sep < 0:
+        raise ValueError("Bad callback data")
+    return data[_CB_HEAD_LEN:sep], data[sep + 1:]
+
+
+# -------------------------
+# Telegram rate limit
+# -------------------------
+class RateLimiter:
+    """
+    Не больше `rate` входов за `period` секунд (скользящее окно).
+    Используется как `async with TG_SEND_LIMITER: await bot.send_message(...)`.
+    """
+
+    def __init__(self, rate: int, period: float = 1.0) -> None:
+        self._rate = rate
+        self._period = period
+        self._calls: deque = deque()
+        self._lock = asyncio.Lock()
+
+    async def __aenter__(self) -> None:
+        loop = asyncio.get_running_loop()
+        async with self._lock:
+            while True:
+                now = loop.time()
+                while self._calls and now - self._calls[0] >= self._period:
+                    self._calls.popleft()
+                if len(self._calls) < self._rate:
+                    self._calls.append(now)
+                    return
+                await asyncio.sleep(self._period - (now - self._calls[0]))
+
+    async def __aexit__(self, *exc: Any) -> None:
+        return None
+
+
+# Лимит Telegram ~30 сообщений/с на бота — оставляем запас
+TG_SEND_LIMITER = RateLimiter(25, 1.0)
 
 
 # -------------------------
 # Keyboards
 # -------------------------
+@functools.lru_cache(maxsize=1)
 def kb_companies() -> InlineKeyboardMarkup:
     builder = InlineKeyboardBuilder()
     for idx, name in enumerate(COMPANIES):
@@ -67,6 +113,8 @@ def kb_tokens(tokens: List[Dict[str, Any]]) -> InlineKeyboardMarkup:
     return builder.as_markup()
 
 
+# Разметка зависит только от id заявки (кнопки одинаковы для любой REQUESTED) — инвалидация не нужна
+@functools.lru_cache(maxsize=512)
 def kb_director_decision(request_id: int) -> InlineKeyboardMarkup:
     builder = InlineKeyboardBuilder()
     builder.add(
@@ -77,6 +125,8 @@ def kb_director_decision(request_id: int) -> InlineKeyboardMarkup:
     return builder.as_markup()
 
 
+# Ключ кэша — (id, статус): смена статуса даёт новый ключ
+@functools.lru_cache(maxsize=512)
 def kb_officer_actions(request_id: int, status: str) -> InlineKeyboardMarkup:
     builder = InlineKeyboardBuilder()
     if status == STATUS_APPROVED:
@@ -90,45 +140,51 @@ def kb_officer_actions(request_id: int, status: str) -> InlineKeyboardMarkup:
 # -------------------------
 # Text formatters
 # -------------------------
+_HTML_ESCAPE_TABLE = str.maketrans({"&": "&amp;", "<": "&lt;", ">": "&gt;"})
+
+
 def escape_html(text: Optional[str]) -> str:
+    # Один проход translate вместо трёх replace с промежуточными строками
     if text is None:
         return ""
-    return (
-        str(text)
-        .replace("&", "&amp;")
-        .replace("<", "&lt;")
-        .replace(">", "&gt;")
-    )
+    return str(text).translate(_HTML_ESCAPE_TABLE)
+
+
+_STATUS_HUMAN: Dict[str, str] = {
+    STATUS_REQUESTED: "🟡 Запрошено (ожидает решения директора)",
+    STATUS_APPROVED: "🟢 Одобрено (ждёт выдачу)",
+    STATUS_REJECTED: "🔴 Отклонено",
+    STATUS_ISSUED: "📦 Выдано (ждёт возврат)",
+    STATUS_RETURNED: "✅ Возвращено",
+}
+
+_STATUS_RU: Dict[str, str] = {
+    STATUS_REQUESTED: "Запрошено",
+    STATUS_APPROVED: "Одобрено",
+    STATUS_REJECTED: "Отклонено",
+    STATUS_ISSUED: "Выдано",
+    STATUS_RETURNED: "Возвращено",
+}
+
+_ACTION_RU: Dict[str, str] = {
+    "REQUESTED": "Создана заявка",
+    "APPROVED": "Одобрено директором",
+    "REJECTED": "Отклонено директором",
+    "ISSUED": "Выдано уполномоченным",
+    "RETURNED": "Возвращено уполномоченным",
+}
 
 
 def status_human(status: str) -> str:
-    return {
-        STATUS_REQUESTED: "🟡 Запрошено (ожидает решения директора)",
-        STATUS_APPROVED: "🟢 Одобрено (ждёт выдачу)",
-        STATUS_REJECTED: "🔴 Отклонено",
-        STATUS_ISSUED: "📦 Выдано (ждёт возврат)",
-        STATUS_RETURNED: "✅ Возвращено",
-    }.get(status, status)
+    return _STATUS_HUMAN.get(status, status)
 
 
 def status_ru(status: str) -> str:
-    return {
-        STATUS_REQUESTED: "Запрошено",
-        STATUS_APPROVED: "Одобрено",
-        STATUS_REJECTED: "Отклонено",
-        STATUS_ISSUED: "Выдано",
-        STATUS_RETURNED: "Возвращено",
-    }.get(status, status)
+    return _STATUS_RU.get(status, status)
 
 
 def action_ru(action: str) -> str:
-    return {
-        "REQUESTED": "Создана заявка",
-        "APPROVED": "Одобрено директором",
-        "REJECTED": "Отклонено директором",
-        "ISSUED": "Выдано уполномоченным",
-        "RETURNED": "Возвращено уполномоченным",
-    }.get(action, action)
+    return _ACTION_RU.get(action, action)
 
 
 def _format_items(items: Optional[List[Dict[str, Any]]]) -> Tuple[str, str, str]:
@@ -141,31 +197,33 @@ def _format_items(items: Optional[List[Dict[str, Any]]]) -> Tuple[str, str, str]
     if not items:
         return "", "", ""
 
-    companies: List[str] = []
-    tokens: List[str] = []
-    norm_items: List[Dict[str, str]] = []
-
-    for it in items:
-        c = str(it.get("company", "")).strip()
-        t = str(it.get("token_id", "")).strip()
-        if c:
-            companies.append(c)
-        if t:
-            tokens.append(t)
-        norm_items.append({"company": c, "token_id": t})
-
-    companies_str = "; ".join(companies)
-    tokens_str = "; ".join(tokens)
-    items_json = json.dumps(norm_items, ensure_ascii=False)
+    pairs = [(str(it.get("company", "")).strip(), str(it.get("token_id", "")).strip()) for it in items]
+
+    companies_str = "; ".join(c for c, _ in pairs if c)
+    tokens_str = "; ".join(t for _, t in pairs if t)
+    items_json = json.dumps([{"company": c, "token_id": t} for c, t in pairs], ensure_ascii=False)
     return companies_str, tokens_str, items_json
 
 
+@functools.lru_cache(maxsize=None)
+def _dataclass_field_names(cls: type) -> Tuple[str, ...]:
+    return tuple(f.name for f in fields(cls))
+
+
+def _row_dict(r: Any) -> Dict[str, Any]:
+    # Строки заявок — плоские slots-датаклассы: getattr по закэшированным полям
+    # вместо рекурсивного копирования asdict (и __dict__ у slots нет)
+    if hasattr(r, "__dataclass_fields__"):
+        return {name: getattr(r, name) for name in _dataclass_field_names(type(r))}
+    return dict(r)
+
+
 def request_card_text(r: Any, items: Optional[List[Dict[str, Any]]] = None) -> str:
     """
     Если items переданы — показываем список "Компания — Токен" (мультизаявка).
     Если items не переданы — показываем одиночную заявку (совместимость).
     """
-    d = asdict(r) if hasattr(r, "__dataclass_fields__") else dict(r)
+    d = _row_dict(r)
 
     rid = d.get("id")
     username = d.get("username") or ""
@@ -184,9 +242,11 @@ def request_card_text(r: Any, items: Optional[List[Dict[str, Any]]] = None) -> s
 
     if requested_at:
         try:
-            dt = datetime.fromisoformat(str(requested_at).replace("Z", "+00:00"))
-            moscow_tz = ZoneInfo("Europe/Moscow")
-            dt_local = dt.astimezone(moscow_tz)
+            if isinstance(requested_at, datetime):
+                dt = requested_at
+            else:
+                dt = datetime.fromisoformat(str(requested_at).replace("Z", "+00:00"))
+            dt_local = dt.astimezone(MOSCOW_TZ)
             lines.append(f"📅 Создана: {dt_local.strftime('%d.%m.%Y %H:%M')}")
         except Exception:
             lines.append(f"📅 Создана: {escape_html(str(requested_at))}")
@@ -208,9 +268,7 @@ def request_card_text(r: Any, items: Optional[List[Dict[str, Any]]] = None) -> s
             f"<code>{escape_html(str(it.get('token_id', '')))}</code>"
             for it in items
         )
-        lines.append("")
-        lines.append("<b>Компании / токены:</b>")
-        lines.append(block)
+        lines += ("", "<b>Компании / токены:</b>", block)
     else:
         if company and str(company) != "MULTI":
             lines.append(f"🏢 Компания: <b>{escape_html(str(company))}</b>")
@@ -221,120 +279,151 @@ def request_card_text(r: Any, items: Optional[List[Dict[str, Any]]] = None) -> s
 
 
 def format_statistics(stats: Dict[str, Any]) -> str:
-    lines = ["📊 <b>Статистика системы</b>", ""]
-
     req = stats.get("requests", {})
-    lines.append("<b>Заявки:</b>")
-    lines.append(f"  Всего: {req.get('total', 0)}")
-    lines.append(f"  На согласовании: {req.get('pending', 0)}")
-    lines.append(f"  Одобрено: {req.get('approved', 0)}")
-    lines.append(f"  Выдано: {req.get('issued', 0)}")
-    lines.append(f"  Возвращено: {req.get('returned', 0)}")
-    lines.append(f"  Отклонено: {req.get('rejected', 0)}")
-
     tokens = stats.get("tokens", {})
-    lines.append("")
-    lines.append("<b>Токены:</b>")
-    for st, count in tokens.items():
-        lines.append(f"  {st}: {count}")
-
-    lines.append("")
-    lines.append("<b>Пользователи:</b>")
-    lines.append(f"  Всего: {stats.get('users_count', 0)}")
-    lines.append(f"  Авторизованных: {stats.get('authed_count', 0)}")
+    # Форма отчёта фиксирована — переменная часть только у токенов по статусам
+    token_lines = "".join(f"\n  {st}: {count}" for st, count in tokens.items())
 
-    return "\n".join(lines)
+    return (
+        "📊 <b>Статистика системы</b>\n"
+        "\n"
+        "<b>Заявки:</b>\n"
+        f"  Всего: {req.get('total', 0)}\n"
+        f"  На согласовании: {req.get('pending', 0)}\n"
+        f"  Одобрено: {req.get('approved', 0)}\n"
+        f"  Выдано: {req.get('issued', 0)}\n"
+        f"  Возвращено: {req.get('returned', 0)}\n"
+        f"  Отклонено: {req.get('rejected', 0)}\n"
+        "\n"
+        f"<b>Токены:</b>{token_lines}\n"
+        "\n"
+        "<b>Пользователи:</b>\n"
+        f"  Всего: {stats.get('users_count', 0)}\n"
+        f"  Авторизованных: {stats.get('authed_count', 0)}"
+    )
 
 
 # -------------------------
 # Nextcloud WebDAV Journal
 # -------------------------
 MOSCOW_TZ = ZoneInfo("Europe/Moscow")
-_journal_lock = asyncio.Lock()
+# Один lock на файл журнала: цикл скачать → дописать → загрузить для одного пути
+# строго последовательный, разные пути друг друга не ждут
+_journal_locks: Dict[str, asyncio.Lock] = {}
+
+
+_webdav_session: Optional[aiohttp.ClientSession] = None
+
+
+def _webdav_http() -> aiohttp.ClientSession:
+    """
+    Одна aiohttp-сессия на процесс: запросы к Nextcloud идут прямо из event loop
+    и переиспользуют keep-alive соединения. Закрывается в close_webdav_session().
+    """
+    global _webdav_session
+    if _webdav_session is None or _webdav_session.closed:
+        _webdav_session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=60))
+    return _webdav_session
+
+
+async def close_webdav_session() -> None:
+    global _webdav_session
+    if _webdav_session is not None and not _webdav_session.closed:
+        await _webdav_session.close()
+    _webdav_session = None
+
+
+def _webdav_file_url(webdav_url: str, remote_path: str) -> str:
+    return webdav_url.rstrip("/") + "/" + quote(remote_path.lstrip("/"))
 
 
 def _msk_now_iso() -> str:
     return datetime.now(MOSCOW_TZ).replace(microsecond=0).isoformat()
 
 
-def _ensure_sheet(wb) -> Worksheet:
+JOURNAL_HEADER = [
+    "ts_msk",
+    "request_id",
+    "action",
+    "actor_tg_id",
+    "user_tg_id",
+    "username",
+    "company",
+    "token_id",
+    "purpose",
+    "comment",
+    "status",
+    "companies",   # NEW
+    "tokens",      # NEW
+    "items_json",  # NEW
+]
+
+
+def _journal_header_row(first_row: Tuple[Any, ...]) -> Optional[List[Any]]:
     """
     Поддерживает старый формат файла и новый (мультизаявка).
-    Если шапка старая — добавит новые колонки в конец.
+    Возвращает шапку, которую нужно записать вместо первой строки:
+    старая шапка дополняется новыми колонками в конец, пустой лист получает
+    шапку целиком. None — строку оставить как есть.
     """
-    ws = wb.active
-
-    def _is_empty_sheet() -> bool:
-        return ws.max_row == 1 and ws.max_column == 1 and ws["A1"].value is None
-
-    header = [
-        "ts_msk",
-        "request_id",
-        "action",
-        "actor_tg_id",
-        "user_tg_id",
-        "username",
-        "company",
-        "token_id",
-        "purpose",
-        "comment",
-        "status",
-        "companies",   # NEW
-        "tokens",      # NEW
-        "items_json",  # NEW
-    ]
-
-    if _is_empty_sheet():
-        ws.title = "Journal"
-        ws.append(header)
-        return ws
-
-    if not ws.title:
-        ws.title = "Journal"
+    if all(x is None for x in first_row):
+        return list(JOURNAL_HEADER)
 
-    first_row = [ws.cell(row=1, column=c).value for c in range(1, ws.max_column + 1)]
     first_row_str = [str(x).strip() if x is not None else "" for x in first_row]
-
     if "ts_msk" in first_row_str and "request_id" in first_row_str:
         existing = set(first_row_str)
-        col = ws.max_column + 1
-        for name in header:
-            if name not in existing:
-                ws.cell(row=1, column=col).value = name
-                col += 1
+        missing = [name for name in JOURNAL_HEADER if name not in existing]
+        if missing:
+            return [*first_row, *missing]
+    return None
 
-    return ws
 
+@dataclass
+class JournalEntry:
+    """Одна строка журнала; время фиксируется в момент события, а не записи."""
 
-async def append_journal_row(
+    request_row: Any
+    action: str
+    actor_tg_id: int
+    request_items: Optional[List[Dict[str, Any]]] = None
+    ts_msk: str = field(default_factory=_msk_now_iso)
+
+
+async def append_journal_rows(
     *,
     webdav_url: str,
     nc_user: str,
     nc_app_password: str,
     journal_path: str,
-    request_row: Any,
-    action: str,
-    actor_tg_id: int,
-    request_items: Optional[List[Dict[str, Any]]] = None,
+    entries: List[JournalEntry],
 ) -> None:
-    async with _journal_lock:
+    """Дописывает пачку строк за один цикл скачать → дописать → загрузить."""
+    if not entries:
+        return
+    session = _webdav_http()
+    url = _webdav_file_url(webdav_url, journal_path)
+    auth = aiohttp.BasicAuth(nc_user, nc_app_password)
+    # setdefault атомарен в пределах event loop — отдельная защита не нужна
+    async with _journal_locks.setdefault(url, asyncio.Lock()):
+        # Кэш забираем сразу: при любой ошибке ниже он не должен пережить цикл
+        cached = _journal_cache.pop(url, None)
         try:
-            await asyncio.to_thread(
-                _append_journal_row_sync,
-                webdav_url,
-                nc_user,
-                nc_app_password,
-                journal_path,
-                request_row,
-                action,
-                actor_tg_id,
-                request_items,
-            )
+            data = await _download_journal(session, url, auth, cached.etag if cached else None)
+            state = cached.state if data is None else None
+            if _is_csv_journal(journal_path):
+                state = payload = _journal_csv_bytes(data if state is None else state, entries)
+            else:
+                # Разбор и сборка xlsx — чистый CPU, уносим из event loop
+                state, payload = await asyncio.to_thread(_append_xlsx_journal, state, data, entries)
+            etag = await _upload_journal(session, url, auth, payload)
+            if etag and _journal_cacheable(state):
+                _journal_cache[url] = _JournalCache(etag, state)
         except Exception as e:
-            log.error(f"Failed to append journal row: {e}")
+            log.error(f"Failed to append journal rows: {e}")
 
 
-def _append_journal_row_sync(
+async def append_journal_row(
+    *,
     webdav_url: str,
     nc_user: str,
     nc_app_password: str,
@@ -342,96 +431,218 @@ def _append_journal_row_sync(
     request_row: Any,
     action: str,
     actor_tg_id: int,
-    request_items: Optional[List[Dict[str, Any]]],
+    request_items: Optional[List[Dict[str, Any]]] = None,
 ) -> None:
-    d = asdict(request_row) if hasattr(request_row, "__dataclass_fields__") else dict(request_row)
+    await append_journal_rows(
+        webdav_url=webdav_url,
+        nc_user=nc_user,
+        nc_app_password=nc_app_password,
+        journal_path=journal_path,
+        entries=[JournalEntry(request_row, action, actor_tg_id, request_items)],
+    )
 
-    options = {
-        "webdav_hostname": webdav_url.rstrip("/") + "/",
-        "webdav_login": nc_user,
-        "webdav_password": nc_app_password,
-        "disable_check": True,
-    }
-    client = Client(options)
 
-    bio = io.BytesIO()
-    exists = False
+def _journal_row_values(entry: JournalEntry) -> List[Any]:
+    r = entry.request_row
+    d = _row_dict(r)
+    companies_str, tokens_str, items_json = _format_items(entry.request_items)
+    return [
+        entry.ts_msk,
+        d.get("id"),
+        action_ru(entry.action),
+        entry.actor_tg_id,
+        d.get("tg_id"),
+        d.get("username") or "",
+        d.get("company"),
+        d.get("token_id"),
+        d.get("purpose"),
+        d.get("comment") or "",
+        status_ru(d.get("status")),
+        companies_str,
+        tokens_str,
+        items_json,
+    ]
 
+
+def _is_csv_journal(journal_path: str) -> bool:
+    return journal_path.lower().endswith(".csv")
+
+
+def _csv_rows_bytes(entries: List[JournalEntry], with_header: bool) -> bytes:
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    if with_header:
+        writer.writerow(JOURNAL_HEADER)
+    writer.writerows(_journal_row_values(entry) for entry in entries)
+    # utf-8-sig только в начале файла: BOM нужен Excel, чтобы открыть кириллицу
+    return buf.getvalue().encode("utf-8-sig" if with_header else "utf-8")
+
+
+async def _download_journal(
+    session: aiohttp.ClientSession, url: str, auth: aiohttp.BasicAuth, etag: Optional[str] = None
+) -> Optional[bytes]:
+    """None — ответ 304: файл не менялся с нашей последней загрузки (ETag из кэша)."""
+    headers = {"If-None-Match": etag} if etag else None
     try:
-        client.download_from(bio, remote_path=journal_path)
-        bio.seek(0)
-        if bio.getbuffer().nbytes > 0:
-            wb = load_workbook(filename=bio)
-            exists = True
-        else:
-            exists = False
+        async with session.get(url, auth=auth, headers=headers) as resp:
+            if resp.status == 304:
+                return None
+            if resp.status == 404:
+                return b""
+            resp.raise_for_status()
+            return await resp.read()
     except Exception as e:
         log.warning(f"Could not download journal file: {e}")
-        exists = False
-
-    if not exists:
-        wb = Workbook()
-
-    ws = _ensure_sheet(wb)
-
-    companies_str, tokens_str, items_json = _format_items(request_items)
-
-    ws.append(
-        [
-            _msk_now_iso(),
-            d.get("id"),
-            action_ru(action),
-            actor_tg_id,
-            d.get("tg_id"),
-            d.get("username") or "",
-            d.get("company"),
-            d.get("token_id"),
-            d.get("purpose"),
-            d.get("comment") or "",
-            status_ru(d.get("status")),
-            companies_str,
-            tokens_str,
-            items_json,
-        ]
-    )
+        return b""
 
-    out = io.BytesIO()
-    wb.save(out)
-    out.seek(0)
 
+async def _put_journal(
+    session: aiohttp.ClientSession, url: str, auth: aiohttp.BasicAuth, payload: bytes
+) -> Optional[str]:
+    async with session.put(url, data=payload, auth=auth) as resp:
+        resp.raise_for_status()
+        return resp.headers.get("ETag")
+
+
+async def _upload_journal(
+    session: aiohttp.ClientSession, url: str, auth: aiohttp.BasicAuth, payload: bytes
+) -> Optional[str]:
+    """Возвращает ETag загруженного файла, если сервер его отдал."""
     try:
-        client.upload_to(out, remote_path=journal_path)
+        return await _put_journal(session, url, auth, payload)
     except Exception as e:
         log.error(f"Failed to upload journal: {e}")
         try:
-            client.clean(remote_path=journal_path)
-            out.seek(0)
-            client.upload_to(out, remote_path=journal_path)
+            async with session.delete(url, auth=auth):
+                pass
+            return await _put_journal(session, url, auth, payload)
         except Exception as e2:
             log.error(f"Failed to recreate journal: {e2}")
             raise
 
 
+def _journal_csv_bytes(data: bytes, entries: List[JournalEntry]) -> bytes:
+    """
+    CSV-журнал: новые строки просто дописываются к скачанным байтам —
+    без разбора и пересборки zip/XML, как у xlsx.
+    """
+    if data and not data.endswith(b"\n"):
+        data += b"\r\n"
+    return data + _csv_rows_bytes(entries, with_header=not data)
+
+
+@dataclass
+class _XlsxJournal:
+    """Значения листов xlsx-журнала: [(название, строки)] и индекс листа с журналом."""
+
+    sheets: List[Tuple[str, List[Any]]]
+    journal_idx: int = 0
+
+    def row_count(self) -> int:
+        return sum(len(rows) for _, rows in self.sheets)
+
+
+def _read_xlsx_journal(data: bytes) -> _XlsxJournal:
+    """
+    Потоковое чтение (read_only): без модели стилизованных ячеек на весь журнал.
+    Берутся значения всех листов (оформление не сохраняется), журнал — активный лист.
+    """
+    src = None
+    if data:
+        try:
+            src = load_workbook(filename=io.BytesIO(data), read_only=True, keep_links=False)
+        except Exception as e:
+            log.warning(f"Could not read journal file: {e}")
+
+    if src is None:
+        return _XlsxJournal([("Journal", [JOURNAL_HEADER])])
+
+    sheets: List[Tuple[str, List[Any]]] = []
+    journal_idx: Optional[int] = None
+    try:
+        active_title = src.active.title if src.active is not None else None
+        for idx, ws in enumerate(src.worksheets):
+            # Размеры в файле могут быть устаревшими — иначе read_only обрежет строки
+            ws.reset_dimensions()
+            rows: List[Any] = list(ws.iter_rows(values_only=True))
+            if journal_idx is None and ws.title == active_title:
+                journal_idx = idx
+                if not rows:
+                    rows.append(JOURNAL_HEADER)
+                else:
+                    header = _journal_header_row(rows[0])
+                    if header is not None:
+                        rows[0] = header
+            sheets.append((ws.title, rows))
+    finally:
+        src.close()
+
+    if journal_idx is None:
+        sheets.append(("Journal", [JOURNAL_HEADER]))
+        journal_idx = len(sheets) - 1
+    return _XlsxJournal(sheets, journal_idx)
+
+
+def _append_xlsx_journal(
+    journal: Optional[_XlsxJournal], data: bytes, entries: List[JournalEntry]
+) -> Tuple[_XlsxJournal, bytes]:
+    """Дописывает строки в журнал (разобранный из data, если кэша нет) и собирает файл write_only."""
+    if journal is None:
+        journal = _read_xlsx_journal(data)
+    journal.sheets[journal.journal_idx][1].extend(_journal_row_values(entry) for entry in entries)
+
+    out_wb = Workbook(write_only=True)
+    for title, rows in journal.sheets:
+        ws = out_wb.create_sheet(title)
+        for row in rows:
+            ws.append(row)
+    out_wb.active = journal.journal_idx
+
+    out = io.BytesIO()
+    out_wb.save(out)
+    return journal, out.getvalue()
+
+
+# -------------------------
+# Journal cache: содержимое последней нашей загрузки + её ETag.
+# Пока файл на сервере не меняли (GET с If-None-Match → 304), журнал не
+# скачивается и не разбирается заново — только дописываются строки.
+# -------------------------
+JOURNAL_CACHE_MAX_ROWS = 50_000
+
+
+@dataclass
+class _JournalCache:
+    etag: str
+    state: Any  # CSV — байты файла, xlsx — _XlsxJournal
+
+
+_journal_cache: Dict[str, _JournalCache] = {}
+
+
+def _journal_cacheable(state: Any) -> bool:
+    if isinstance(state, _XlsxJournal):
+        return state.row_count() <= JOURNAL_CACHE_MAX_ROWS
+    return True
+
+
 async def webdav_healthcheck(
     webdav_url: str,
     nc_user: str,
     nc_app_password: str,
     journal_path: str,
 ) -> Tuple[bool, str]:
+    session = _webdav_http()
+    auth = aiohttp.BasicAuth(nc_user, nc_app_password)
     try:
-        options = {
-            "webdav_hostname": webdav_url.rstrip("/") + "/",
-            "webdav_login": nc_user,
-            "webdav_password": nc_app_password,
-            "disable_check": True,
-        }
-        client = Client(options)
-        client.list("/")
-
-        try:
-            client.info(remote_path=journal_path)
-            return True, "OK (journal exists)"
-        except Exception:
+        async with session.request(
+            "PROPFIND", webdav_url.rstrip("/") + "/", auth=auth, headers={"Depth": "0"}
+        ) as resp:
+            resp.raise_for_status()
+
+        async with session.head(_webdav_file_url(webdav_url, journal_path), auth=auth) as resp:
+            if resp.status < 400:
+                return True, "OK (journal exists)"
             return True, "OK (journal will be created)"
     except Exception as e:
         return False, f"{type(e).__name__}: {str(e)}"
@@ -452,6 +663,8 @@ def is_superadmin(tg_id: int, settings) -> bool:
     return int(tg_id) in set(getattr(settings, "superadmin_ids", []) or [])
 
 
+# Статичные админские клавиатуры: строим один раз на процесс
+@functools.lru_cache(maxsize=1)
 def kb_admin_menu() -> InlineKeyboardMarkup:
     kb = InlineKeyboardBuilder()
     kb.button(text="📊 Статистика", callback_data="adm:stats")
@@ -474,7 +687,8 @@ def kb_admin_menu() -> InlineKeyboardMarkup:
 
 async def safe_edit_text(call: CallbackQuery, text: str, reply_markup: InlineKeyboardMarkup | None = None) -> None:
     try:
-        await call.message.edit_text(text, reply_markup=reply_markup)
+        async with TG_SEND_LIMITER:
+            await call.message.edit_text(text, reply_markup=reply_markup)
     except TelegramBadRequest as e:
         if "message is not modified" in str(e):
             try:
@@ -488,29 +702,33 @@ async def safe_edit_text(call: CallbackQuery, text: str, reply_markup: InlineKey
         await call.answer("Ошибка при обновлении сообщения", show_alert=True)
 
 
+@functools.lru_cache(maxsize=1)
 def kb_back_to_admin() -> InlineKeyboardMarkup:
     kb = InlineKeyboardBuilder()
     kb.button(text="⬅️ Назад", callback_data="adm:menu")
     return kb.as_markup()
 
 
+_TOKEN_STATUS_TITLE: Dict[str, str] = {
+    "available": "✅ Доступны",
+    "reserved": "🟡 Зарезервированы",
+    "issued": "📦 Выданы",
+}
+
+
 def format_token_list(tokens: List[Dict[str, Any]]) -> str:
     if not tokens:
         return "Нет токенов в базе данных."
 
     lines = ["<b>Список токенов:</b>", ""]
 
-    by_status: Dict[str, List[Dict[str, Any]]] = {}
+    # Группы — в порядке первого появления статуса; внутри — порядок из БД (по token_id)
+    by_status: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
     for token in tokens:
-        status = token.get("status", "unknown")
-        by_status.setdefault(status, []).append(token)
+        by_status[token.get("status", "unknown")].append(token)
 
     for status, token_list in by_status.items():
-        status_text = {
-            "available": "✅ Доступны",
-            "reserved": "🟡 Зарезервированы",
-            "issued": "📦 Выданы",
-        }.get(status, status)
+        status_text = _TOKEN_STATUS_TITLE.get(status, status)
 
         lines.append(f"<b>{status_text} ({len(token_list)}):</b>")
         for token in token_list: